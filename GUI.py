@@ -5,12 +5,14 @@ description: A file to build the client GUI
 """
 import logging
 import os
-import pickle
 import time
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox
 from threading import Thread, Event
-from files import idle_prime, keygen, save_image
+from files import keygen, save_image
+from prime_engine import get_engine
+from prime_pool import PrimePool
+from prime_store import PrimeStore
 from tkinter.filedialog import askdirectory
 from chaotic_source import Random, test_camera
 from client import client_thread
@@ -246,10 +248,11 @@ class Collector(tk.Frame):
         """
         logging.debug("GUI: Started creating collector frame")
         tk.Frame.__init__(self, parent)
-        self._done = Event()
-        self._coll = None
+        self._pool = None
         label = ttk.Label(self, text="Beep Boop!\nCollecting...", font=LARGEFONT)
         label.grid(row=0, column=4, padx=10, pady=80)
+        self.status = ttk.Label(self, text="Collector stopped")
+        self.status.grid(row=1, column=4, padx=10, pady=10)
 
         # button to show frame 3 with text
         # layout3
@@ -270,21 +273,45 @@ class Collector(tk.Frame):
 
     def start(self):
         """
-        Function to start the prime collector thread
+        Function to start the prime pool, it keeps running when leaving the page until stopped
         """
-        self._coll = Thread(target=idle_prime, args=(self._done,))
-        self._coll.start()
+        if self._pool is None:
+            # the pool searches with the engine keygen uses, rather than starting a second set of workers
+            self._pool = PrimePool(engine=get_engine())
+            self._pool.start()
+            self.show_status()
         logging.debug("GUI: Started idle prime search")
 
+    def show_status(self):
+        """
+        function to show the pool's fill level and production rate, refreshed every second while it runs
+        """
+        if self._pool is None:
+            self.status.configure(text="Collector stopped")
+            return
+        status = self._pool.status()
+        if status["error"] is not None:
+            self.status.configure(text="Collector failed: %s" % status["error"])
+            return
+        state = "collecting" if status["state"] == "filling" else status["state"]
+        self.status.configure(text="%d/%d primes stored, %s, %.1f primes/min" % (
+            status["level"], status["high"], state, status["rate"] * 60))
+        self.after(1000, self.show_status)
+
+    def stop_pool(self):
+        """
+        function to stop the prime pool if it is running
+        """
+        if self._pool:
+            self._pool.stop()
+            self._pool = None
+            logging.debug("GUI: Finished idle prime search")
+
     def stop(self, controller):
         """
-        function to stop the thread and exit the page back to the SSH keygen window
+        function to stop the prime pool and exit the page back to the SSH keygen window
         """
-        if self._coll:
-            self._done.set()
-            self._coll.join()
-            self._coll = None
-        logging.debug("GUI: Finished idle prime search")
+        self.stop_pool()
         controller.show_frame(SSH)
 
 
@@ -299,8 +326,8 @@ class Rand(tk.Frame):
         logging.debug("GUI: Started creating RNG frame")
         tk.Frame.__init__(self, parent)
         self.controller = controller
+        # the page keeps its lease on the shared camera session, the device itself is only open while in use
         self.random = Random()
-        self.random.pause()
         label1 = ttk.Label(self, text="RNG", font=("Verdana", 40))
         label1.place(x=1050, y=0)
 
@@ -361,7 +388,6 @@ class Rand(tk.Frame):
         """
         A function to get 2 random numbers from the entries and generate an integer in between them
         """
-        self.random.cont()
         start = self.startval.get()
         end = self.endval.get()
         logging.debug("GUI: Random number requested between %d and %d" % (int(start), int(end)))
@@ -371,7 +397,6 @@ class Rand(tk.Frame):
             val = self.random.get_int_range(int(start), int(end) - 1)
         self.resultval = str(val)
         self.result.configure(text=("Number: " + str(val)))
-        self.random.pause()
         logging.debug("GUI: received random number %d" % val)
 
     def copy_val(self, gui: Gui):
@@ -393,11 +418,9 @@ class Rand(tk.Frame):
         A function to generate a random image and place it in the label created for it
         """
         logging.debug("GUI: random image requested")
-        self.random.cont()
         self.random.rand_pic("temp.png")
         self.img = tk.PhotoImage(file="temp.png")
         self.image.configure(image=self.img)
-        self.random.pause()
         logging.debug("GUI: random image successfully got")
 
     def validate_start(self):
@@ -484,10 +507,8 @@ def main():
     sets its size and calls the main loop
     """
     logging.info("App started")
-    if not os.path.exists("primes.bin"):  # check for primes file (storage), creates an empty one if it isn't found
-        with open("primes.bin", "wb") as file:
-            pickle.dump([], file)
-    logging.info("Check for primes file successful")
+    # opening the prime store creates it if it isn't found (and converts an old pickled one)
+    logging.info("Check for primes file successful, %d primes stored" % PrimeStore().available())
     if not test_camera():  # make sure camera is connected
         messagebox.showerror("Camera not found", "The computer's camera is not available")
         return
@@ -499,6 +520,8 @@ def main():
     style()
     logging.info("Mainloop starting")
     app.mainloop()
+    # the prime pool keeps running when its page is left, so it is stopped with the app
+    app.frames[Collector].stop_pool()
 
 
 # Driver Code
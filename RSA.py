@@ -6,14 +6,60 @@ description: A file for math- and RSA-related functions such as primality tests
 """
 from chaotic_source import Random
 import logging
+import secrets
+import threading
+from math import isqrt
+import numpy as np
+from drbg import Drbg, SEED_SIZE
 
+PUBLIC_EXPONENT = 65537
+# key size -> (prime size, rabin-miller rounds), the rounds are FIPS 186-4 table C.3's for a 2^-100 error probability
+KEY_PROFILES = {2048: (1024, 5), 3072: (1536, 4), 4096: (2048, 4)}
+DEFAULT_KEY_SIZE = 2048
+# odd primes below SIEVE_LIMIT sieve out candidates before they reach rabin-miller
+SIEVE_LIMIT = 1 << 16
+# odd candidates sieved at a time, a 1024 bit prime is usually found within the first window
+SIEVE_WINDOW = 1 << 12
 
-def rabin_miller(num, accuracy, rand: Random):
+
+def small_primes(limit):
     """
-    rabin-miller primality test
+    sieve of eratosthenes
+    :param limit: upper bound (exclusive)
+    :return: int64 array of the primes below limit
+    """
+    sieve = np.ones(limit, dtype=bool)
+    sieve[:2] = False
+    for i in range(2, int(limit ** 0.5) + 1):
+        if sieve[i]:
+            sieve[i * i::i] = False
+    return np.flatnonzero(sieve)
+
+
+SIEVE_PRIMES = small_primes(SIEVE_LIMIT)[1:]
+
+
+def witnesses(num, count, rand):
+    """
+    draw random rabin-miller witnesses in [2, num - 2] from a single random request
     :param num: number to test
+    :param count: number of witnesses
+    :param rand: RNG object, a Random or a Drbg
+    :return: list of witnesses
+    """
+    # 64 extra bits per witness make the modulo bias negligible
+    size = (num.bit_length() + 64 + 7) // 8
+    data = rand.get_random_bytes(size * count)
+    return [int.from_bytes(data[i * size:(i + 1) * size], "big") % (num - 3) + 2 for i in range(count)]
+
+
+def rabin_miller(num, accuracy, rand: Random = None, bases=None):
+    """
+    rabin-miller primality test
+    :param num: number to test, odd and larger than 3
     :param accuracy: number of trials (iterations)
-    :param rand: RNG object
+    :param rand: RNG object the witnesses are drawn from, a Random or a Drbg
+    :param bases: fixed witnesses to use instead of random ones
     :return: likely prime/not prime
     """
 
@@ -28,8 +74,9 @@ def rabin_miller(num, accuracy, rand: Random):
         s = s // 2
         t += 1
 
-    for trials in range(accuracy):  # try to falsify num's primality
-        a = rand.get_int_range(2, num - 1)
+    if bases is None:
+        bases = witnesses(num, accuracy, rand)
+    for a in bases:  # try to falsify num's primality
         v = pow(a, s, num)
         if v != 1:  # this test does not apply if v is 1.
             i = 0
@@ -44,6 +91,81 @@ def rabin_miller(num, accuracy, rand: Random):
     return True
 
 
+def jacobi(a, n):
+    """
+    jacobi symbol (a/n)
+    :param a: any integer
+    :param n: odd positive integer
+    :return: -1, 0 or 1
+    """
+    a %= n
+    result = 1
+    while a:
+        while a % 2 == 0:
+            a //= 2
+            if n % 8 in (3, 5):
+                result = -result
+        a, n = n, a
+        if a % 4 == 3 and n % 4 == 3:
+            result = -result
+        a %= n
+    return result if n == 1 else 0
+
+
+def strong_lucas(num):
+    """
+    strong lucas probable prime test with selfridge's parameters (the first D in 5, -7, 9, -11, ... with (D/num) = -1,
+    P = 1, Q = (1 - D) / 4)
+    :param num: odd number to test, larger than 3
+    :return: likely prime/not prime
+    """
+    if isqrt(num) ** 2 == num:
+        return False  # no D exists for perfect squares
+    d = 5
+    while True:
+        j = jacobi(d, num)
+        if j == -1:
+            break
+        if j == 0 and abs(d) != num:
+            return False
+        d = -d - 2 if d > 0 else -d + 2
+    q = (1 - d) // 4
+    s = num + 1
+    r = 0
+    while s % 2 == 0:
+        s //= 2
+        r += 1
+    # U_k, V_k and Q^k modulo num by binary expansion of s, halving with (x + num) / 2 when x is odd
+    u, v, qk = 1, 1, q % num
+    for bit in bin(s)[3:]:
+        u, v = u * v % num, (v * v - 2 * qk) % num
+        qk = qk * qk % num
+        if bit == "1":
+            u, v = u + v, d * u + v
+            u = (u + num if u % 2 else u) // 2 % num
+            v = (v + num if v % 2 else v) // 2 % num
+            qk = qk * q % num
+    if u == 0 or v == 0:
+        return True
+    for i in range(r - 1):
+        v = (v * v - 2 * qk) % num
+        qk = qk * qk % num
+        if v == 0:
+            return True
+    return False
+
+
+def baillie_psw(num):
+    """
+    baillie-psw primality test: a rabin-miller round with the fixed base 2 and a strong lucas test. Deterministic and
+    with no known counterexample, and needs no random witnesses
+    :param num: number to test, odd and larger than 3
+    :return: likely prime/not prime
+    """
+    logging.debug("RSA: Testing if %d is prime with baillie-psw" % num)
+    return rabin_miller(num, 1, bases=[2]) and strong_lucas(num)
+
+
 def is_prime(num, rand: Random, accuracy=10):
     """
     basic small prime check, else calls the rabin-miller test
@@ -123,7 +245,7 @@ def rsa(p, q):
     logging.debug("RSA: Generating key pair for %d, %d" % (p, q))
     n = p * q
     lam_n = lcm(p-1, q-1)
-    e = 65537
+    e = PUBLIC_EXPONENT
     assert gcd(e, lam_n) == 1
     d = pow(e, -1, lam_n)
     assert (e*d) % lam_n == 1
@@ -131,17 +253,168 @@ def rsa(p, q):
     return n, e, d
 
 
-def get_prime(rand):
+def sieve_window(residues, size):
+    """
+    mark the odd candidates base, base + 2, ... base + 2 * (size - 1) that have a factor in SIEVE_PRIMES
+    :param residues: base modulo each of SIEVE_PRIMES
+    :param size: number of candidates
+    :return: bool array, True where the candidate is composite
+    """
+    composite = np.zeros(size, dtype=bool)
+    # base + 2i is divisible by p when i = -base / 2 (mod p), and 1/2 is (p + 1) / 2 modulo an odd p
+    first = (SIEVE_PRIMES - residues) * ((SIEVE_PRIMES + 1) // 2) % SIEVE_PRIMES
+    small = np.searchsorted(SIEVE_PRIMES, size)
+    for p, start in zip(SIEVE_PRIMES[:small].tolist(), first[:small].tolist()):
+        composite[start::p] = True
+    # larger primes hit the window at most once
+    hits = first[small:]
+    composite[hits[hits < size]] = True
+    return composite
+
+
+class CrtKey:
+    """
+    RSA private key operations through the chinese remainder theorem, about 3-4 times faster than a single pow with
+    the full private exponent. The input is blinded with a random factor so the time taken doesn't depend on it, and
+    the result can be checked against the public key to catch faulty computations, which would leak a factor of n
+    """
+    def __init__(self, n, e, d, p, q, verify=True):
+        """
+        :param n: modulus
+        :param e: public exponent
+        :param d: private exponent
+        :param p: prime 1
+        :param q: prime 2
+        :param verify: check every result with the public exponent before returning it
+        """
+        self.n, self.e, self.p, self.q = n, e, p, q
+        self.dp = d % (p - 1)
+        self.dq = d % (q - 1)
+        self.q_inv = pow(q, -1, p)
+        self.verify = verify
+        self.lock = threading.Lock()
+        self.blind = self.unblind = None
+        self._new_blinding()
+
+    @classmethod
+    def from_key(cls, key, verify=True):
+        """
+        :param key: pycryptodome private key, like RSA.importKey returns
+        :param verify: see __init__
+        :return: CrtKey of the key
+        """
+        return cls(key.n, key.e, key.d, key.p, key.q, verify)
+
+    def _new_blinding(self):
+        """
+        pick a fresh blinding factor r, keeping r^e for the input and r^-1 for the output
+        """
+        # the factor only has to be unpredictable, so the OS generator is enough and the server needs no camera
+        r = secrets.randbelow(self.n - 2) + 2
+        while gcd(r, self.n) != 1:
+            r = secrets.randbelow(self.n - 2) + 2
+        self.blind, self.unblind = pow(r, self.e, self.n), pow(r, -1, self.n)
+
+    def decrypt(self, c):
+        """
+        the private key operation c^d mod n
+        :param c: integer smaller than n
+        :return: c^d mod n
+        """
+        with self.lock:
+            blind, unblind = self.blind, self.unblind
+            # squaring both gives the pair of r^2, much cheaper than a new factor
+            self.blind, self.unblind = blind * blind % self.n, unblind * unblind % self.n
+        x = c * blind % self.n
+        m1 = pow(x, self.dp, self.p)
+        m2 = pow(x, self.dq, self.q)
+        h = self.q_inv * (m1 - m2) % self.p
+        m = (m2 + h * self.q) * unblind % self.n
+        if self.verify and pow(m, self.e, self.n) != c % self.n:
+            logging.error("RSA: CRT private key operation failed verification")
+            raise ArithmeticError("RSA private key operation failed verification")
+        return m
+
+
+def search_prime(b, drbg: Drbg = None, stats=None, cancel=None, rounds=10):
+    """
+    find the first prime from an odd base on that can be an RSA factor (p - 1 coprime to the public exponent). The odd
+    numbers from the base on are sieved a window at a time, and only the sieve survivors get a primality test
+    :param b: odd base to start from
+    :param drbg: generator the rabin-miller witnesses are drawn from, baillie-psw is used if not given
+    :param stats: optional dict, the number of candidates checked is added to its "candidates" key and the number of
+    primality tests to its "tests" key
+    :param cancel: optional event, the search gives up once it is set
+    :param rounds: number of rabin-miller rounds
+    :return: the prime, or None if cancelled
+    """
+    residues = np.array([b % p for p in SIEVE_PRIMES.tolist()], dtype=np.int64)
+    candidates = tests = 0
+    prime = None
+    while prime is None:
+        for i in np.flatnonzero(~sieve_window(residues, SIEVE_WINDOW)).tolist():
+            if cancel is not None and cancel.is_set():
+                logging.debug("RSA: Prime search cancelled")
+                return None
+            num = b + 2 * i
+            if num % PUBLIC_EXPONENT == 1:
+                continue
+            tests += 1
+            if rabin_miller(num, rounds, drbg) if drbg is not None else baillie_psw(num):
+                candidates += i + 1
+                prime = num
+                break
+        else:
+            # no prime in this window, move on to the next one
+            candidates += SIEVE_WINDOW
+            b += 2 * SIEVE_WINDOW
+            residues = (residues + 2 * SIEVE_WINDOW) % SIEVE_PRIMES
+    if stats is not None:
+        stats["candidates"] = stats.get("candidates", 0) + candidates
+        stats["tests"] = stats.get("tests", 0) + tests
+    logging.debug("RSA: Found prime %d" % prime)
+    return prime
+
+
+def prime_base(rand, bits):
+    """
+    get a random odd base to search for a prime from, with the top two bits set so the product of two such primes is
+    exactly twice as long
+    :param rand: the random number generator object
+    :param bits: bit length of the prime
+    :return: the base
+    """
+    return rand.get_rand_large(bits) | (3 << (bits - 2)) | 1
+
+
+def fits_profile(prime, key_size=DEFAULT_KEY_SIZE):
+    """
+    :param prime: a prime
+    :param key_size: RSA key size
+    :return: whether the prime can be a factor of a key of that size (right length, top two bits set)
+    """
+    return prime >> (KEY_PROFILES[key_size][0] - 2) == 3
+
+
+def get_prime(rand, stats=None, test="rabin_miller", key_size=DEFAULT_KEY_SIZE):
     """
     A function to get a prime number based on a randomly generated number
     :param rand: the random number generator object
+    :param stats: optional dict, see search_prime
+    :param test: "rabin_miller", with witnesses from a DRBG seeded once per search, or "bpsw" (baillie-psw)
+    :param key_size: RSA key size the prime is for, one of KEY_PROFILES
     """
-    logging.debug("RSA: Prime number requested")
-    b = rand.get_rand_large(1024) | 1  # generate random int and make sure it is odd (only even prime is 2, not needed)
-    while not is_prime(b, rand):
-        b += 2  # if not prime, go to the next odd number until prime is found
-    logging.debug("RSA: Found prime %d" % b)
-    return b
+    assert test in ("rabin_miller", "bpsw")
+    bits, rounds = KEY_PROFILES[key_size]
+    logging.debug("RSA: %d bit prime number requested" % bits)
+    prime = None
+    # the search may run past the top of the range when the base is very close to it, start over if it does
+    while prime is None or not fits_profile(prime, key_size):
+        b = prime_base(rand, bits)
+        # the witnesses need to be unpredictable, not full entropy, so one seed covers the whole search
+        drbg = Drbg(seed=rand.get_random_bytes(SEED_SIZE)) if test == "rabin_miller" else None
+        prime = search_prime(b, drbg, stats, rounds=rounds)
+    return prime
 
 
 if __name__ == '__main__':
@@ -0,0 +1,306 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: Benchmark suite for CameRAND - bit extraction, prime search, key generation and the chat server - run
+headless against a synthetic or replayed frame source, with JSON results that can be compared against a baseline
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import socket
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from Crypto.PublicKey import RSA as CryptoRSA
+import client
+import files
+import server
+from chaotic_source import Random
+from frame_source import SOURCE_ENV, source_from_spec
+from framing import VERSION
+from prime_engine import PrimeEngine
+from RSA import KEY_PROFILES, get_prime
+
+STAGES = ("extraction", "prime", "engine", "keygen", "profiles", "chat")
+TOLERANCE = 0.2
+
+
+def metric(name, value, unit, better):
+    """
+    :param name: metric name
+    :param value: measured value
+    :param unit: unit of the value
+    :param better: "higher" or "lower", the direction counted as an improvement
+    :return: metric dict
+    """
+    return {"name": name, "value": value, "unit": unit, "better": better}
+
+
+def latency_metrics(name, times):
+    """
+    :param name: metric name prefix
+    :param times: list of per-call durations in seconds
+    :return: mean and p95 latency metrics in milliseconds
+    """
+    times = np.array(times) * 1000
+    return [metric(name + ".mean_ms", float(times.mean()), "ms", "lower"),
+            metric(name + ".p95_ms", float(np.percentile(times, 95)), "ms", "lower")]
+
+
+def bench_extraction(spec, repeat):
+    """
+    bits/sec and per-call latency of get_random_bits, get_int_range and rand_pic
+    """
+    rand = Random(source_from_spec(spec))
+    res = []
+    for bits in (36, 1024, 1 << 16):
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            rand.get_random_bits(bits)
+            times.append(time.perf_counter() - start)
+        res.append(metric("get_random_bits.%d.bits_per_sec" % bits, bits * repeat / sum(times), "bit/s", "higher"))
+        res.extend(latency_metrics("get_random_bits.%d" % bits, times))
+    times = []
+    for i in range(repeat * 10):
+        start = time.perf_counter()
+        rand.get_int_range(0, 1000000)
+        times.append(time.perf_counter() - start)
+    res.extend(latency_metrics("get_int_range", times))
+    times = []
+    path = os.path.join(tempfile.mkdtemp(), "pic.png")
+    for i in range(repeat):
+        start = time.perf_counter()
+        rand.rand_pic(path)
+        times.append(time.perf_counter() - start)
+    res.extend(latency_metrics("rand_pic", times))
+    rand.pause()
+    return res
+
+
+def bench_prime(spec, repeat):
+    """
+    candidates/sec and time-to-prime of RSA.get_prime
+    """
+    rand = Random(source_from_spec(spec))
+    stats = {}
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        get_prime(rand, stats)
+        times.append(time.perf_counter() - start)
+    rand.pause()
+    return [metric("get_prime.candidates_per_sec", stats["candidates"] / sum(times), "1/s", "higher")] + \
+        latency_metrics("get_prime", times)
+
+
+def bench_engine(spec, repeat):
+    """
+    time to two primes (a key's worth) through the prime engine with one worker, two workers and one per core, and
+    the speedup of the most workers over one
+    """
+    rand = Random(source_from_spec(spec))
+    res = []
+    means = {}
+    for workers in sorted({1, 2, os.cpu_count() or 1}):
+        engine = PrimeEngine(workers)
+        # the first search pays for starting the worker processes
+        engine.get_primes(rand, 1)
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            engine.get_primes(rand, 2)
+            times.append(time.perf_counter() - start)
+        engine.close()
+        means[workers] = sum(times) / len(times)
+        res.extend(latency_metrics("prime_engine.%d_workers" % workers, times))
+    res.append(metric("prime_engine.speedup", means[1] / means[max(means)], "x", "higher"))
+    rand.pause()
+    return res
+
+
+def time_keygen(spec, repeat, key_size):
+    """
+    time files.keygen in an empty directory, so the prime store is empty and the primes are generated inline
+    :return: list of durations in seconds
+    """
+    # keygen makes its own Random objects, the benchmark source is only put in the environment for them
+    previous = os.environ.get(SOURCE_ENV)
+    os.environ[SOURCE_ENV] = spec
+    cwd = os.getcwd()
+    times = []
+    try:
+        for i in range(repeat):
+            os.chdir(tempfile.mkdtemp())
+            start = time.perf_counter()
+            files.keygen(os.getcwd(), key_size)
+            times.append(time.perf_counter() - start)
+    finally:
+        os.chdir(cwd)
+        if previous is None:
+            os.environ.pop(SOURCE_ENV, None)
+        else:
+            os.environ[SOURCE_ENV] = previous
+    return times
+
+
+def bench_keygen(spec, repeat):
+    """
+    end-to-end files.keygen time of the default key size
+    """
+    return latency_metrics("keygen", time_keygen(spec, repeat, 2048))
+
+
+def bench_profiles(spec, repeat):
+    """
+    keygen time and keys/hour of every key size profile, for capacity planning
+    """
+    res = []
+    for key_size in KEY_PROFILES:
+        times = time_keygen(spec, repeat, key_size)
+        res.extend(latency_metrics("keygen.%d" % key_size, times))
+        res.append(metric("keygen.%d.keys_per_hour" % key_size, 3600 * repeat / sum(times), "1/h", "higher"))
+    return res
+
+
+def start_server():
+    """
+    run server.main on a free local port in a background thread, with a throwaway key
+    :return: the server address
+    """
+    key_path = os.path.join(tempfile.mkdtemp(), "id_rsa")
+    with open(key_path, "wb") as file:
+        file.write(CryptoRSA.generate(2048).exportKey())
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    addr = probe.getsockname()
+    probe.close()
+    threading.Thread(target=server.main, args=(key_path, addr), daemon=True).start()
+    for i in range(100):
+        try:
+            socket.create_connection(addr).close()
+            return addr
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start")
+
+
+def connect(addr, name, rand, version=VERSION):
+    """
+    connect a client and wait until the server echoes its first message, so the whole handshake is measured
+    :return: (FramedSocket, cipher)
+    """
+    sock = socket.create_connection(addr)
+    conn, cipher = client.handshake(sock, name, rand, version)
+    conn.send("bin", cipher.encrypt(b"ping"))
+    while not cipher.decrypt(conn.recv()[1]).endswith(b": ping"):
+        pass
+    return conn, cipher
+
+
+def bench_chat(spec, repeat):
+    """
+    handshake latency and messages/sec through server.main, with the current protocol version and with version 1
+    """
+    rand = Random(source_from_spec(spec))
+    addr = start_server()
+    res = []
+    for version in (VERSION, 1):
+        # the current version's metrics keep their original names so older baselines still compare
+        name = "" if version == VERSION else ".v%d" % version
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            conn, cipher = connect(addr, "bench%d" % i, rand, version)
+            times.append(time.perf_counter() - start)
+            conn.send("end")
+            conn.sock.close()
+        conn, cipher = connect(addr, "bench", rand, version)
+        count = repeat * 100
+        start = time.perf_counter()
+        for i in range(count):
+            conn.send("bin", cipher.encrypt(b"message %d" % i))
+        received = 0
+        while received < count:
+            if b": message" in cipher.decrypt(conn.recv()[1]):
+                received += 1
+        elapsed = time.perf_counter() - start
+        conn.send("end")
+        conn.sock.close()
+        res.extend(latency_metrics("handshake" + name, times))
+        res.append(metric("chat%s.messages_per_sec" % name, count / elapsed, "1/s", "higher"))
+    rand.pause()
+    return res
+
+
+def run(spec, stages, repeat):
+    """
+    run the chosen benchmark stages
+    :param spec: frame source spec
+    :param stages: list of stage names
+    :param repeat: repetitions of each measurement
+    :return: results dict
+    """
+    benches = {"extraction": bench_extraction, "prime": bench_prime, "engine": bench_engine, "keygen": bench_keygen,
+               "profiles": bench_profiles, "chat": bench_chat}
+    metrics = []
+    for stage in stages:
+        logging.info("Benchmark: Running %s" % stage)
+        metrics.extend(benches[stage](spec, repeat))
+    return {"source": spec, "repeat": repeat, "python": sys.version.split()[0], "machine": platform.machine(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "metrics": metrics}
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    compare results against a baseline
+    :param results: results dict
+    :param baseline: baseline results dict
+    :param tolerance: allowed relative change in the worse direction
+    :return: list of (name, baseline value, value, relative change) of every regressed metric
+    """
+    base = {m["name"]: m["value"] for m in baseline["metrics"]}
+    regressions = []
+    for m in results["metrics"]:
+        if m["name"] not in base or not base[m["name"]]:
+            continue
+        change = (m["value"] - base[m["name"]]) / base[m["name"]]
+        if (change < -tolerance) if m["better"] == "higher" else (change > tolerance):
+            regressions.append((m["name"], base[m["name"]], m["value"], change))
+    return regressions
+
+
+def main():
+    """
+    run the benchmarks from the command line, exits with 1 if a metric regressed against the baseline
+    """
+    parser = argparse.ArgumentParser(description="CameRAND benchmark suite")
+    parser.add_argument("--source", default="synthetic:1", help="frame source spec, e.g. synthetic:1 or replay:x.npy")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma separated stages to run")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions of each measurement")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed relative regression")
+    args = parser.parse_args()
+    results = run(args.source, args.stages.split(","), args.repeat)
+    for m in results["metrics"]:
+        print("%-40s %16.3f %s" % (m["name"], m["value"], m["unit"]))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for name, old, new, change in regressions:
+            print("REGRESSION %s: %.3f -> %.3f (%+.0f%%)" % (name, old, new, change * 100))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -0,0 +1,172 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: Bulk RSA key provisioning from the command line. Generates many key pairs into a directory tree (one
+directory per key) or a single tar archive, taking primes from the prime store first and the parallel prime engine
+for the rest, while a thread pool exports and writes the keys already made
+"""
+import argparse
+import io
+import logging
+import os
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from entropy_service import get_random
+from files import key_files
+from prime_engine import PrimeEngine
+from prime_store import PrimeStore
+from RSA import DEFAULT_KEY_SIZE, KEY_PROFILES
+
+THREADS = 4
+ARCHIVE_MODES = {".tar": "w", ".tar.gz": "w:gz", ".tgz": "w:gz"}
+
+
+class DirWriter:
+    """
+    writes every key pair into its own directory, as id_rsa and id_rsa.pub
+    """
+    def __init__(self, path):
+        """
+        :param path: root directory, created if missing
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, name, files):
+        """
+        :param name: key name, the directory the files are written to
+        :param files: dict of file name to contents
+        """
+        directory = os.path.join(self.path, name)
+        os.makedirs(directory, exist_ok=True)
+        for file_name, data in files.items():
+            # private keys are only readable by their owner
+            fd = os.open(os.path.join(directory, file_name), os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o644 if file_name.endswith(".pub") else 0o600)
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+
+    def close(self):
+        pass
+
+
+class TarWriter:
+    """
+    writes every key pair into a tar archive, under a directory named after the key
+    """
+    def __init__(self, path):
+        """
+        :param path: archive path, .tar, .tar.gz or .tgz
+        """
+        self.path = path
+        self.tar = tarfile.open(path, next(mode for ext, mode in ARCHIVE_MODES.items() if path.endswith(ext)))
+        self.lock = threading.Lock()
+
+    def write(self, name, files):
+        """
+        :param name: key name, the directory in the archive the files are written to
+        :param files: dict of file name to contents
+        """
+        with self.lock:
+            for file_name, data in files.items():
+                info = tarfile.TarInfo(name + "/" + file_name)
+                info.size = len(data)
+                info.mode = 0o644 if file_name.endswith(".pub") else 0o600
+                info.mtime = int(time.time())
+                self.tar.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self.tar.close()
+
+
+def export(writer, name, p, q):
+    """
+    build a key pair's files and write them, runs on the export threads
+    """
+    writer.write(name, key_files(p, q))
+
+
+def get_writer(out):
+    """
+    :param out: output path, an archive if it has an archive extension and a directory otherwise
+    :return: writer for the path
+    """
+    if any(out.endswith(ext) for ext in ARCHIVE_MODES):
+        return TarWriter(out)
+    return DirWriter(out)
+
+
+def provision(count, out, key_size=DEFAULT_KEY_SIZE, threads=THREADS, workers=None, use_store=True, prefix="key"):
+    """
+    generate count key pairs
+    :param count: number of key pairs
+    :param out: output directory or archive path
+    :param key_size: RSA key size, one of RSA.KEY_PROFILES
+    :param threads: number of export threads
+    :param workers: number of prime engine worker processes, the number of cores by default
+    :param use_store: take primes from the prime store before generating any
+    :param prefix: key names are the prefix followed by the key's index
+    :return: report dict (keys, from_store, generated, seconds, keys_per_sec)
+    """
+    start = time.perf_counter()
+    writer = get_writer(out)
+    primes = PrimeStore(key_size).take(2 * count) if use_store else []
+    from_store = len(primes)
+    logging.info("BulkKeygen: Took %d primes from the store" % from_store)
+    made = 0
+    futures = []
+    engine = None
+    rand = None
+    try:
+        with ThreadPoolExecutor(threads) as executor:
+            while True:
+                # export every pair available while the engine searches for the next batch
+                while len(primes) >= 2 and made < count:
+                    p, q = primes.pop(), primes.pop()
+                    name = "%s%0*d" % (prefix, len(str(count - 1)), made)
+                    futures.append(executor.submit(export, writer, name, p, q))
+                    made += 1
+                if made == count:
+                    break
+                if engine is None:
+                    engine = PrimeEngine(workers)
+                    rand = get_random()
+                primes += engine.get_primes(rand, min(2 * (count - made) - len(primes), 2 * engine.workers),
+                                            key_size=key_size)
+            for future in futures:
+                future.result()
+    finally:
+        if engine is not None:
+            engine.close()
+            rand.pause()
+        writer.close()
+    seconds = time.perf_counter() - start
+    logging.info("BulkKeygen: Wrote %d keys to %s in %.1f seconds" % (count, out, seconds))
+    return {"keys": count, "from_store": from_store, "generated": 2 * count - from_store, "seconds": seconds,
+            "keys_per_sec": count / seconds if seconds else 0.0}
+
+
+def main():
+    """
+    provision keys from the command line
+    """
+    parser = argparse.ArgumentParser(description="CameRAND bulk RSA key provisioning")
+    parser.add_argument("count", type=int, help="number of key pairs")
+    parser.add_argument("out", help="output directory, or a .tar/.tar.gz/.tgz archive")
+    parser.add_argument("--key-size", type=int, default=DEFAULT_KEY_SIZE, choices=sorted(KEY_PROFILES))
+    parser.add_argument("--threads", type=int, default=THREADS, help="export threads")
+    parser.add_argument("--workers", type=int, help="prime search processes, the number of cores by default")
+    parser.add_argument("--no-store", action="store_true", help="generate every prime instead of using the store")
+    parser.add_argument("--prefix", default="key", help="key name prefix")
+    args = parser.parse_args()
+    report = provision(args.count, args.out, args.key_size, args.threads, args.workers, not args.no_store,
+                       args.prefix)
+    print("%d keys in %.2f seconds (%.2f keys/sec), %d primes from the store, %d generated" % (
+        report["keys"], report["seconds"], report["keys_per_sec"], report["from_store"], report["generated"]))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename="bulk_keygen.log", level=logging.INFO)
+    main()
@@ -0,0 +1,71 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: Drop-in replacement for python's random.Random (like random.SystemRandom) backed by the camera entropy
+pool, so code written against the standard library can use CameRAND without changes
+"""
+import logging
+import random
+from chaotic_source import Random
+
+BPF = 53  # number of bits in a float
+RECIP_BPF = 2 ** -BPF
+
+
+class CameraRandom(random.Random):
+    """
+    random.Random on top of a (buffered) chaotic_source.Random. Only random, getrandbits and randbytes draw from the
+    camera, every other method (choice, gauss, sample, ...) is inherited and built on them
+    """
+    def __init__(self, rand: Random = None, **kwargs):
+        """
+        :param rand: the RNG object to draw from, a new one is made with kwargs if not given
+        :param kwargs: arguments for the new RNG object (source, mode, conditioner, ...)
+        """
+        self.rand = Random(**kwargs) if rand is None else rand
+        super().__init__()
+        logging.debug("CameraRandom: created new adapter")
+
+    def random(self):
+        """
+        :return: random float in range [0, 1) with 53 random bits
+        """
+        return (int.from_bytes(self.rand.get_random_bytes(7), "big") >> 3) * RECIP_BPF
+
+    def getrandbits(self, k):
+        """
+        :param k: number of bits
+        :return: non-negative int with k random bits
+        """
+        if k < 0:
+            raise ValueError("number of bits must be non-negative")
+        length = (k + 7) // 8
+        return int.from_bytes(self.rand.get_random_bytes(length), "big") >> (length * 8 - k)
+
+    def randbytes(self, n):
+        """
+        :param n: number of bytes
+        :return: n random bytes
+        """
+        return self.rand.get_random_bytes(n)
+
+    def read(self, n):
+        """
+        os.urandom compatible byte source, for libraries that accept a randfunc
+        :param n: number of bytes
+        :return: n random bytes
+        """
+        return self.rand.get_random_bytes(n)
+
+    def seed(self, *args, **kwds):
+        """
+        stub, a camera can't be seeded
+        """
+        return None
+
+    def _notimplemented(self, *args, **kwds):
+        """
+        method called for getstate and setstate, the camera has no state to save or restore
+        """
+        raise NotImplementedError("Camera entropy source does not have state.")
+    getstate = setstate = _notimplemented
@@ -0,0 +1,190 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: Process-wide camera session. Every Random object in the process leases the same device instead of
+opening its own, the device is opened lazily and closed after it has been idle for a while, and a single capture
+thread hands the frames out
+"""
+import logging
+import threading
+import time
+from collections import deque
+from frame_source import FrameSource, default_source
+
+IDLE_TIMEOUT = 5.0
+
+
+class FrameRequest:
+    """
+    a single pending read, filled in by the capture thread
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = (False, None)
+
+
+class CameraSession:
+    """
+    owner of the process' frame source. Each captured frame is handed to exactly one waiting reader, two consumers
+    never get the same frame (that would give them the same random bits)
+    """
+    def __init__(self, factory=default_source, idle_timeout=IDLE_TIMEOUT):
+        """
+        :param factory: function creating the (unopened) frame source when the device is first needed
+        :param idle_timeout: seconds without reads after which the device is closed
+        """
+        self.factory = factory
+        self.idle_timeout = idle_timeout
+        self.source = None
+        self.leases = 0
+        self.idle_since = time.monotonic()
+        self.requests = deque()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.opens = 0
+        self.frames = 0
+
+    def lease(self):
+        """
+        take a lease on the session, the device itself is only opened on the first read and closed again once no read
+        came for idle_timeout, lease or no lease
+        """
+        with self.cond:
+            self.leases += 1
+            logging.debug("CameraSession: Leased, %d leases" % self.leases)
+
+    def unlease(self):
+        """
+        give a lease back
+        """
+        with self.cond:
+            self.leases = max(self.leases - 1, 0)
+            logging.debug("CameraSession: Lease returned, %d leases" % self.leases)
+            self.cond.notify_all()
+
+    def read(self):
+        """
+        read a frame through the capture thread
+        :return: (success, BGR frame) like cv2.VideoCapture.read
+        """
+        request = FrameRequest()
+        with self.cond:
+            self.requests.append(request)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._capture, daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+        request.done.wait()
+        return request.result
+
+    def _close(self):
+        """
+        close the device, must be called from the capture thread
+        """
+        if self.source is not None:
+            logging.info("CameraSession: Closing camera")
+            try:
+                self.source.release()
+            except Exception:
+                logging.exception("CameraSession: Failed to release the camera")
+            self.source = None
+
+    def _read_frame(self):
+        """
+        open the device if needed and read a frame from it, a failed device is closed so the next read reopens it
+        :return: (success, BGR frame)
+        """
+        try:
+            if self.source is None:
+                logging.info("CameraSession: Opening camera")
+                self.source = self.factory()
+                self.source.open()
+                self.opens += 1
+            if self.source.is_opened():
+                return self.source.read()
+            logging.error("CameraSession: Camera failed to open")
+        except Exception:
+            logging.exception("CameraSession: Camera read failed")
+        # try opening again on the next read instead of failing forever
+        self._close()
+        return False, None
+
+    def _capture(self):
+        """
+        capture thread loop, opens the device when there are reads waiting and closes it once it is idle
+        """
+        self.idle_since = time.monotonic()
+        try:
+            while True:
+                with self.cond:
+                    while not self.requests:
+                        # the device stays open for a while after the last read so that back to back reads (and a
+                        # Random object created right after another one was paused) don't reopen it. Leases don't
+                        # keep it open, a Random object can hold one for the whole life of the app, and the next read
+                        # reopens the device
+                        timeout = self.idle_timeout - (time.monotonic() - self.idle_since)
+                        if timeout <= 0:
+                            self._close()
+                            return
+                        self.cond.wait(timeout)
+                    request = self.requests.popleft()
+                try:
+                    request.result = self._read_frame()
+                    self.frames += 1
+                finally:
+                    # a reader is never left waiting, whatever happened to its frame
+                    request.done.set()
+                self.idle_since = time.monotonic()
+        finally:
+            with self.cond:
+                self.thread = None
+                # reads queued after the thread was done with the queue start a new thread
+                if self.requests:
+                    self.thread = threading.Thread(target=self._capture, daemon=True)
+                    self.thread.start()
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    get the process-wide camera session, creating it on first use
+    :return: the camera session
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = CameraSession()
+        return _session
+
+
+class SharedCameraSource(FrameSource):
+    """
+    frame source reading through a camera session, the default source of Random objects
+    """
+    def __init__(self, session: CameraSession = None):
+        """
+        :param session: the session to lease, the process-wide one if not given
+        """
+        self.session = get_session() if session is None else session
+        self.leased = False
+
+    def open(self):
+        if not self.leased:
+            self.session.lease()
+            self.leased = True
+
+    def read(self):
+        if not self.leased:
+            return False, None
+        return self.session.read()
+
+    def release(self):
+        if self.leased:
+            self.leased = False
+            self.session.unlease()
+
+    def is_opened(self):
+        return self.leased
@@ -7,75 +7,305 @@ based on camera digital chip interference as a true chaotic source
 
 import logging
 import math
+import threading
 import cv2
 import numpy as np
+from frame_source import FrameSource
+from camera_session import SharedCameraSource
+from conditioning import Conditioner
+from health import HealthMonitor
+from drbg import Drbg, RESEED_BYTES, RESEED_INTERVAL
+from harvesting import Harvester, LsbHarvester
+
+# default size of the entropy pool and the fill level under which it is refilled, in bytes
+POOL_SIZE = 1 << 18
+LOW_WATER = 1 << 16
+
+
+class EntropyPool:
+    """
+    a bounded pool of random bytes served out with a read cursor and refilled from whole frames by a background
+    capture thread, so small requests don't cost a camera read each
+    """
+    def __init__(self, fill, size=POOL_SIZE, low_water=LOW_WATER):
+        """
+        :param fill: function returning a block of fresh random bytes (one frame's worth)
+        :param size: maximal number of bytes kept in the pool
+        :param low_water: the pool is refilled once fewer bytes than this are left
+        """
+        self.fill = fill
+        self.size = size
+        self.low_water = low_water
+        self.buf = bytearray()
+        self.cursor = 0
+        self.cond = threading.Condition()
+        self.thread = None
+        self.stopped = False
+        self.error = None
+
+    def available(self):
+        """
+        :return: the number of unread bytes in the pool
+        """
+        return len(self.buf) - self.cursor
+
+    def _refill(self):
+        """
+        thread loop that captures blocks until the pool is full, then exits
+        """
+        logging.debug("EntropyPool: Refill started")
+        while True:
+            with self.cond:
+                if self.stopped or self.available() >= self.size:
+                    self.thread = None
+                    self.cond.notify_all()
+                    logging.debug("EntropyPool: Refill finished with %d bytes" % self.available())
+                    return
+            try:
+                block = self.fill()
+            except Exception as err:
+                logging.exception("EntropyPool: Refill failed")
+                with self.cond:
+                    self.error = err
+                    self.thread = None
+                    self.cond.notify_all()
+                return
+            with self.cond:
+                # drop the bytes that were already served before appending the new ones
+                del self.buf[:self.cursor]
+                self.cursor = 0
+                self.buf += block[:self.size - len(self.buf)]
+                self.cond.notify_all()
+
+    def _start(self):
+        """
+        start the refill thread if it isn't running, must be called while holding the lock
+        """
+        if self.thread is None and not self.stopped:
+            self.thread = threading.Thread(target=self._refill, daemon=True)
+            self.thread.start()
+
+    def take(self, n: int):
+        """
+        take n bytes out of the pool, waiting for the refill thread if there aren't enough
+        :param n: number of bytes
+        :return: bytes object of length n
+        """
+        out = bytearray()
+        with self.cond:
+            while len(out) < n:
+                if self.error is not None:
+                    # hand the refill thread's error (camera malfunction, failed health test) to the caller
+                    err, self.error = self.error, None
+                    raise err
+                if self.stopped:
+                    raise RuntimeError("Entropy pool is paused")
+                part = min(n - len(out), self.available())
+                out += self.buf[self.cursor:self.cursor + part]
+                self.cursor += part
+                if self.available() < self.low_water:
+                    self._start()
+                if len(out) < n:
+                    self.cond.wait()
+        return bytes(out)
+
+    def stop(self):
+        """
+        stop refilling and wait for the refill thread to finish its current frame
+        """
+        with self.cond:
+            self.stopped = True
+            thread = self.thread
+            self.cond.notify_all()
+        if thread is not None:
+            thread.join()
+
+    def resume(self):
+        """
+        allow refilling again after stop
+        """
+        with self.cond:
+            self.stopped = False
 
 
 class Random:
     """
     a class similar to python's Random except using camera interference as a true chaotic source
     """
-    def __init__(self):
+    def __init__(self, source: FrameSource = None, buffered=True, pool_size=POOL_SIZE, low_water=LOW_WATER,
+                 conditioner: Conditioner = None, health: HealthMonitor = None, mode="entropy", drbg_algorithm="aes",
+                 reseed_bytes=RESEED_BYTES, reseed_interval=RESEED_INTERVAL, harvester: Harvester = None):
         """
         generate an RNG object
+        :param source: the frame source to use, a lease on the process' shared camera session if not given
+        :param buffered: serve bits out of an entropy pool filled from full frames instead of capturing per request
+        :param pool_size: size of the entropy pool in bytes
+        :param low_water: the pool is refilled in the background once fewer bytes than this are left
+        :param conditioner: conditioning stage applied to the raw bits of every frame, none if not given
+        :param health: health tests run on the raw bits of every frame, default tests if not given, False for none
+        :param mode: "entropy" to serve camera bits directly, "drbg" to only seed a fast generator with them
+        :param drbg_algorithm: aes or chacha20, the generator used in drbg mode
+        :param reseed_bytes: in drbg mode, reseed from the camera after this many output bytes
+        :param reseed_interval: in drbg mode, reseed from the camera after this many seconds
+        :param harvester: which bits of the full frames are used, the LSB of each grayscale pixel if not given
         """
+        assert mode in ("entropy", "drbg")
+        self.source = SharedCameraSource() if source is None else source
+        self.conditioner = conditioner
+        self.harvester = LsbHarvester() if harvester is None else harvester
+        self.health = HealthMonitor() if health is None else health or None
+        self.pool = EntropyPool(self._frame_block, pool_size, low_water) if buffered else None
         # open up the camera
-        self.cam = cv2.VideoCapture(0, cv2.CAP_DSHOW)
+        self.source.open()
+        # key material (get_rand_large) always comes straight from the camera, even in drbg mode
+        self.drbg = Drbg(self._entropy_bytes, drbg_algorithm, reseed_bytes, reseed_interval) if mode == "drbg" \
+            else None
 
     def __del__(self):
         """
         stop the camera when the object is deleted
         """
-        self.cam.release()
+        if hasattr(self, "source"):
+            self.pause()
 
     def pause(self):
         """
         stop the camera to allow for another Random object to use it/extra protection in case __del__ doesn't trigger
         """
-        self.cam.release()
+        if self.pool is not None:
+            self.pool.stop()
+        self.source.release()
 
     def cont(self):
         """
         restart the camera after pause
         """
-        self.cam = cv2.VideoCapture(0, cv2.CAP_DSHOW)
+        self.source.open()
+        if self.pool is not None:
+            self.pool.resume()
 
-    def get_random_bits(self, rang: int):
+    def _read_raw(self):
         """
-        A function that gets a random string of bits that are roughly the size of rang
+        read a single colour frame from the camera
+        :return: the BGR frame as a uint8 array
+        """
+        assert self.source.is_opened()
+        check, frame = self.source.read()
+        # check if the camera returned an image
+        if not check or frame is None:
+            logging.exception("Random: Camera fail")
+            raise RuntimeError("Camera malfunction, please try again. In case this error persists,"
+                               " try replacing camera.")
+        return frame
+
+    def _read_frame(self):
+        """
+        read a single grayscale frame from the camera
+        :return: the frame as a 2d uint8 array
+        """
+        return cv2.cvtColor(self._read_raw(), cv2.COLOR_BGR2GRAY)
+
+    def _frame_block(self):
+        """
+        get the harvested bits of full resolution frames (by default the lsb of every pixel of one frame), health
+        tested and passed through the conditioner if there is one. used to fill the entropy pool
+        :return: the bits packed into bytes, empty if the frames were quarantined
+        """
+        block = self.harvester.harvest([self._read_raw() for i in range(self.harvester.frames)])
+        if self.health is not None and not self.health.check(block):
+            return b""
+        if self.conditioner is not None:
+            block = self.conditioner.condition(block)
+        return block
+
+    def _conditioned_bytes(self, n: int):
+        """
+        get n conditioned bytes without the pool, capturing as many full frames as the conditioner needs
+        :param n: number of bytes
+        :return: bytes object of length n
+        """
+        out = b""
+        while len(out) < n:
+            out += self._frame_block()
+        return out[:n]
+
+    def get_random_array(self, rang: int, full_entropy=False):
+        """
+        A function that gets random bits as a numpy array, from the drbg, the entropy pool or straight from the camera
         :param rang: bit length
-        :return: a string of random bits with length rang
+        :param full_entropy: skip the drbg in drbg mode
+        :return: uint8 array of length rang holding a single random bit (0/1) in each cell
         """
+        if self.drbg is not None and not full_entropy:
+            data = np.frombuffer(self.drbg.get_random_bytes(math.ceil(rang / 8)), dtype=np.uint8)
+            return np.unpackbits(data)[:rang]
+        if self.pool is not None:
+            logging.debug("Random: Requested %d bits from pool" % rang)
+            data = np.frombuffer(self.pool.take(math.ceil(rang / 8)), dtype=np.uint8)
+            return np.unpackbits(data)[:rang]
+        if self.conditioner is not None:
+            data = np.frombuffer(self._conditioned_bytes(math.ceil(rang / 8)), dtype=np.uint8)
+            return np.unpackbits(data)[:rang]
         # get the rough size of a square picture so that the number of pixels is around equal to the
         # number of required bits
         logging.debug("Random: Requested %d bits from camera" % rang)
         size = math.ceil(math.sqrt(rang))
-        assert self.cam.isOpened()
-        check, frame = self.cam.read()
-        assert check == 1
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        # check if the camera returned an image
-        if frame is None:
-            logging.exception("Random: Camera fail")
-            raise RuntimeError("Camera malfunction, please try again. In case this error persists,"
-                               " try replacing camera.")
-        # get correct number of bits
+        while True:
+            frame = self._read_frame()
+            # the bits go out raw, so the frame gets the same health tests as the pool's blocks. They run on the lsbs
+            # of the whole frame, a block of a few bits would repeat by chance and fail the frame identity test
+            if self.health is None or self.health.check(np.packbits(np.bitwise_and(frame, 1)).tobytes()):
+                break
         frame = cv2.resize(frame, (size, size))
-        numlist = []
-        # get a list of every pixel's luminance value
-        for i in frame.tolist():
-            numlist.extend(i)
         logging.debug("Random: Successfully got requested bits")
-        # get the lsb of each value (most random) as a string in the correct length
-        return "".join([str(x % 2) for x in numlist[:rang]])
+        # the lsb of each pixel's luminance value is the most random bit
+        return np.bitwise_and(frame.ravel()[:rang], 1)
+
+    def get_random_bits(self, rang: int):
+        """
+        A function that gets a random string of bits that are roughly the size of rang
+        :param rang: bit length
+        :return: a string of random bits with length rang
+        """
+        return (self.get_random_array(rang) + ord("0")).tobytes().decode()
 
-    def get_rand_large(self, size: int):
+    def _entropy_bytes(self, n: int):
+        """
+        Get n full entropy bytes, from the entropy pool or packed from the lsb of 8n camera pixels
+        :param n: number of bytes
+        :return: bytes object of length n
+        """
+        if self.pool is not None:
+            return self.pool.take(n)
+        if self.conditioner is not None:
+            return self._conditioned_bytes(n)
+        return np.packbits(self.get_random_array(n * 8, full_entropy=True)).tobytes()
+
+    def get_random_bytes(self, n: int, full_entropy=False):
+        """
+        Get n random bytes, from the drbg in drbg mode and from the camera otherwise
+        :param n: number of bytes
+        :param full_entropy: skip the drbg in drbg mode, for key material
+        :return: bytes object of length n
+        """
+        logging.debug("Random: Requested %d bytes" % n)
+        if self.drbg is not None and not full_entropy:
+            return self.drbg.get_random_bytes(n)
+        return self._entropy_bytes(n)
+
+    def get_rand_large(self, size: int, full_entropy=True):
         """
         get a large random integer, used for RSA keygen
-        :return: large (128 byte) integer
+        :param size: bit length of the integer
+        :param full_entropy: skip the drbg in drbg mode, on by default since the result is usually key material
+        :return: large (size bit) integer
         """
         logging.debug("Random: Requested number with %d size" % size)
-        return int("0b" + self.get_random_bits(size), 2)
+        if size <= 0:
+            return 0
+        length = math.ceil(size / 8)
+        # drop the extra bits of the last byte so the number is exactly size bits long
+        return int.from_bytes(self.get_random_bytes(length, full_entropy), "big") >> (length * 8 - size)
 
     def get_rand_range(self, start: float, stop: float):
         """
@@ -86,8 +316,7 @@ class Random:
         """
         logging.debug("Random: Requested float in range %f to %f" % (start, stop))
         rang = (stop-start)
-        bits = self.get_random_bits(36)
-        num = int("0b" + bits, 2)
+        num = self.get_rand_large(36, full_entropy=False)
         pct = num/(pow(2, 36) - 1)
         # get a random number from 0 to rang and add it to start, promising a decimal in the range. pct is a random
         # percentage between 0 and 100 that is multiplied by rang to get the random number in range
@@ -101,14 +330,19 @@ class Random:
         :param stop: end
         :return: a random int between start and end
         """
-        logging.debug("Random: Requested float in range %d to %d" % (start, stop))
+        logging.debug("Random: Requested int in range %d to %d" % (start, stop))
         rang = stop-start
-        num = int("0b" + self.get_random_bits(rang.bit_length()), 2)
+        if 0 <= rang < 1 << 63:
+            # small ranges go through the batched sampler, a single word with a rare rejection
+            num = int(self._below(np.array([rang + 1], dtype=np.uint64))[0])
+            logging.debug("Random: Got number %d" % (start + num))
+            return start + num
+        num = self.get_rand_large(rang.bit_length(), full_entropy=False)
         # since this is an int, the num is only the same bit size as rang, and I must make sure it is smaller than it
         # or request another number
         while num > rang:
             logging.info("Random: Requested number between %d and %d, got %d instead" % (start, stop, num + start))
-            num = int("0b" + self.get_random_bits(rang.bit_length()), 2)
+            num = self.get_rand_large(rang.bit_length(), full_entropy=False)
         logging.debug("Random: Got number %d" % (start + num))
         return start + num
 
@@ -118,46 +352,121 @@ class Random:
         :param name: filename to save the picture as
         """
         logging.debug("Random: Requested random image")
-        check, frame = self.cam.read()
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        frame = cv2.resize(frame, (64, 96))
-        numlist = []
-        bytes_list = []
-        for i in frame.tolist():
-            numlist.extend(i)
-        bits = "".join([str(x % 2) for x in numlist])
+        # get 6144 bits (8*16*16*3) bits and pack them into bytes, one for each color channel of each pixel, then
+        # reshape them to 16x16x3
+        photo = np.frombuffer(self.get_random_bytes(16 * 16 * 3), dtype=np.uint8).reshape((16, 16, 3))
         logging.debug("Random: Got all bits for random image")
-        # get 6144 bits (8*16*16*3) bits and split them into bytes, one for each color channel of each pixel, then
-        # put them into an array and reshape it to 16x16x3
-        while bits:
-            bytes_list.append(int("0b" + bits[:8], 2))
-            bits = bits[8:]
-        photo = np.array(bytes_list).reshape((16, 16, 3))
-        mul = np.ones((16, 16, 1))
+        mul = np.ones((16, 16, 1), dtype=np.uint8)
         # resize the image from 16x16 to 256x256 without smoothing pixels using a kronecker product
         frame = np.kron(photo, mul)
         cv2.imwrite(name, frame)
         logging.debug("Random: Successfully saved random image")
 
+    def _below(self, bounds: np.ndarray):
+        """
+        Get a batch of unbiased random ints, each below its own bound, out of a single block of random bytes.
+        Words that would bias the modulo are rejected and redrawn (rarely more than one extra small block)
+        :param bounds: array of bounds, each between 1 and 2^64 - 1
+        :return: uint64 array of random ints, the i-th in range [0, bounds[i])
+        """
+        dtype = np.uint32 if len(bounds) and int(bounds.max()) <= 1 << 32 else np.uint64
+        bounds = bounds.astype(np.uint64)
+        # 2^w mod bound, every word under it belongs to an incomplete last cycle of the modulo and is rejected
+        thresholds = (np.uint64(1 << 32) % bounds if dtype == np.uint32 else (np.uint64(0) - bounds) % bounds)
+        out = np.empty(len(bounds), dtype=np.uint64)
+        todo = np.arange(len(bounds))
+        while len(todo):
+            words = np.frombuffer(self.get_random_bytes(len(todo) * np.dtype(dtype).itemsize), dtype=dtype)
+            words = words.astype(np.uint64)
+            good = words >= thresholds[todo]
+            out[todo[good]] = words[good] % bounds[todo[good]]
+            todo = todo[~good]
+        return out
+
+    def randint_array(self, n: int, lo: int, hi: int):
+        """
+        Get n random ints between lo and hi (both included) in one batch
+        :param n: number of ints
+        :param lo: start
+        :param hi: end, hi - lo must be below 2^63
+        :return: int64 numpy array of n random ints
+        """
+        logging.debug("Random: Requested %d ints in range %d to %d" % (n, lo, hi))
+        assert 0 <= hi - lo < 1 << 63
+        return self._below(np.full(n, hi - lo + 1, dtype=np.uint64)).astype(np.int64) + lo
+
+    def random_array(self, n: int):
+        """
+        Get n random floats in range [0, 1) in one batch, each with 53 random bits like python's random()
+        :param n: number of floats
+        :return: float64 numpy array of n random floats
+        """
+        words = np.frombuffer(self.get_random_bytes(n * 8), dtype=np.uint64)
+        return (words >> np.uint64(11)) * (1.0 / (1 << 53))
+
     def shuffle(self, shuff: list):
-        for i in range(len(shuff) - 1, 0, -1):
-            place = self.get_int_range(0, i)
-            print(place, i)
+        """
+        Shuffle a list in place (Fisher-Yates), drawing all the swap places in one batch
+        :param shuff: list to shuffle
+        :return: the shuffled list
+        """
+        places = self._below(np.arange(len(shuff), 1, -1, dtype=np.uint64)).tolist()
+        for i, place in zip(range(len(shuff) - 1, 0, -1), places):
             shuff[i], shuff[place] = shuff[place], shuff[i]
         return shuff
 
+    def sample(self, population, k: int):
+        """
+        Get k unique elements of population, in random order
+        :param population: sequence to sample from
+        :param k: number of elements
+        :return: list of k elements
+        """
+        n = len(population)
+        if not 0 <= k <= n:
+            raise ValueError("Sample larger than population or is negative")
+        # partial Fisher-Yates over the indexes, only the first k places are needed
+        places = (self._below(np.arange(n, n - k, -1, dtype=np.uint64)) + np.arange(k, dtype=np.uint64)).tolist()
+        indexes = list(range(n))
+        for i, place in enumerate(places):
+            indexes[i], indexes[place] = indexes[place], indexes[i]
+        return [population[i] for i in indexes[:k]]
+
+    def choices(self, population, weights=None, k: int = 1):
+        """
+        Get k elements of population with replacement, optionally weighted
+        :param population: sequence to choose from
+        :param weights: relative weight of each element, uniform if not given
+        :param k: number of elements
+        :return: list of k elements
+        """
+        n = len(population)
+        if not n:
+            raise IndexError("Cannot choose from an empty sequence")
+        if weights is None:
+            indexes = self._below(np.full(k, n, dtype=np.uint64))
+        else:
+            cum = np.cumsum(np.asarray(weights, dtype=np.float64))
+            if len(cum) != n:
+                raise ValueError("The number of weights does not match the population")
+            indexes = np.searchsorted(cum, self.random_array(k) * cum[-1], side="right")
+            indexes = np.minimum(indexes, n - 1)
+        return [population[i] for i in indexes.tolist()]
+
 
-def test_camera():
+def test_camera(source: FrameSource = None):
     """
     Function used to test if the camera is available
+    :param source: the frame source to test, the shared camera session if not given
     :return: camera available t/f
     """
     logging.info("Testing for camera")
-    cam = cv2.VideoCapture(0, cv2.CAP_DSHOW)  # open camera
-    res = not (cam is None or not cam.isOpened())  # check if object is an open camera or not
+    source = SharedCameraSource() if source is None else source
+    source.open()  # open camera
+    res = source.is_opened() and source.read()[0]  # check if the source is open and gives frames
     logstring = "" if res else " not"
     logging.info("Camera is%s working" % logstring)
-    cam.release()  # release camera in case it is valid to not hold it
+    source.release()  # release camera (the shared session keeps it open for a while for the next user)
     return res
 
 
@@ -0,0 +1,164 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: Conditioning stage between the camera and the output of Random. Raw LSBs are slightly biased and the
+neighbouring pixels are correlated, so they are debiased/compressed into fewer, better bits before being served
+"""
+import hashlib
+import logging
+import numpy as np
+
+
+class Conditioner:
+    """
+    base class for conditioners, counts the bits going in and out to report the output rate
+    """
+    name = "none"
+
+    def __init__(self):
+        """
+        init the bit counters
+        """
+        self.bits_in = 0
+        self.bits_out = 0
+
+    def _condition(self, raw: np.ndarray):
+        """
+        the conditioning itself, implemented by each conditioner
+        :param raw: uint8 array of raw packed bits
+        :return: conditioned bytes
+        """
+        return raw.tobytes()
+
+    def condition(self, raw: bytes):
+        """
+        condition a block of raw packed bits. Conditioners may keep leftover bits between calls, so the output
+        length isn't always proportional to the input length
+        :param raw: raw bytes from the camera
+        :return: conditioned bytes
+        """
+        out = self._condition(np.frombuffer(raw, dtype=np.uint8))
+        self.bits_in += len(raw) * 8
+        self.bits_out += len(out) * 8
+        return out
+
+    def rate(self):
+        """
+        :return: the output rate so far, conditioned bits per raw bit
+        """
+        return self.bits_out / self.bits_in if self.bits_in else 0.0
+
+    def report(self):
+        """
+        :return: dict with the name, bit counters and output rate of the conditioner
+        """
+        return {"name": self.name, "bits_in": self.bits_in, "bits_out": self.bits_out, "rate": self.rate()}
+
+
+class VonNeumann(Conditioner):
+    """
+    Von Neumann debiasing: every pair of bits gives its first bit if the two differ and nothing otherwise.
+    Removes bias completely for independent bits, at a rate of at most 1/4
+    """
+    name = "vonneumann"
+
+    def __init__(self):
+        super().__init__()
+        # bits left over from the last call (an odd bit, or output bits that don't fill a byte yet)
+        self.carry_in = np.zeros(0, dtype=np.uint8)
+        self.carry_out = np.zeros(0, dtype=np.uint8)
+
+    def _condition(self, raw: np.ndarray):
+        bits = np.concatenate((self.carry_in, np.unpackbits(raw)))
+        pairs = bits[:len(bits) // 2 * 2].reshape(-1, 2)
+        self.carry_in = bits[len(bits) // 2 * 2:]
+        out = np.concatenate((self.carry_out, pairs[pairs[:, 0] != pairs[:, 1], 0]))
+        whole = len(out) // 8 * 8
+        self.carry_out = out[whole:]
+        return np.packbits(out[:whole]).tobytes()
+
+
+class ToeplitzExtractor(Conditioner):
+    """
+    Toeplitz hashing randomness extractor, every n_in raw bits are multiplied by an n_out x n_in Toeplitz matrix over
+    GF(2). The matrix is public, it only has to be random and independent of the camera
+    """
+    name = "toeplitz"
+
+    def __init__(self, n_in=1024, n_out=512, seed: bytes = None):
+        """
+        :param n_in: raw bits per block
+        :param n_out: output bits per block, should be below the min-entropy of n_in raw bits
+        :param seed: at least (n_in + n_out - 1) / 8 bytes defining the matrix, a fixed public seed if not given
+        """
+        super().__init__()
+        assert n_out % 8 == 0 and n_out <= n_in
+        self.n_in = n_in
+        self.n_out = n_out
+        length = n_in + n_out - 1
+        if seed is None:
+            seed = hashlib.shake_256(b"CameRAND Toeplitz seed").digest((length + 7) // 8)
+        diag = np.unpackbits(np.frombuffer(seed, dtype=np.uint8))[:length]
+        assert len(diag) == length, "Toeplitz seed too short"
+        # T[i, j] = diag[i - j + n_in - 1], every row is the previous one shifted right by one
+        rows = np.lib.stride_tricks.sliding_window_view(diag, n_in)[:, ::-1]
+        # float32 matrix product is exact here (sums of at most n_in ones) and runs on BLAS
+        self.matrix = np.ascontiguousarray(rows.T, dtype=np.float32)
+        self.carry = np.zeros(0, dtype=np.uint8)
+
+    def _condition(self, raw: np.ndarray):
+        bits = np.concatenate((self.carry, np.unpackbits(raw)))
+        blocks = len(bits) // self.n_in
+        self.carry = bits[blocks * self.n_in:]
+        if not blocks:
+            return b""
+        product = bits[:blocks * self.n_in].reshape(blocks, self.n_in).astype(np.float32) @ self.matrix
+        return np.packbits(product.astype(np.uint32) & 1).tobytes()
+
+
+class HashConditioner(Conditioner):
+    """
+    vetted hash conditioning (SHA-256 or SHAKE-256), every block of raw bytes is hashed into fewer output bytes
+    """
+    def __init__(self, algorithm="sha256", block=64, out=32):
+        """
+        :param algorithm: sha256 or shake_256
+        :param block: raw bytes hashed into each output
+        :param out: output bytes per block, always 32 for sha256
+        """
+        super().__init__()
+        assert algorithm in ("sha256", "shake_256")
+        self.name = algorithm
+        self.algorithm = algorithm
+        self.block = block
+        self.out = 32 if algorithm == "sha256" else out
+        self.carry = b""
+
+    def _condition(self, raw: np.ndarray):
+        data = self.carry + raw.tobytes()
+        blocks = len(data) // self.block
+        self.carry = data[blocks * self.block:]
+        view = memoryview(data)
+        if self.algorithm == "sha256":
+            return b"".join(hashlib.sha256(view[i * self.block:(i + 1) * self.block]).digest()
+                            for i in range(blocks))
+        return b"".join(hashlib.shake_256(view[i * self.block:(i + 1) * self.block]).digest(self.out)
+                        for i in range(blocks))
+
+
+def get_conditioner(name: str):
+    """
+    build a conditioner by its name, used by command line tools
+    :param name: none, vonneumann, toeplitz, sha256 or shake_256
+    :return: a new conditioner, None for none
+    """
+    logging.debug("Conditioning: Creating %s conditioner" % name)
+    if name == "none":
+        return None
+    if name == "vonneumann":
+        return VonNeumann()
+    if name == "toeplitz":
+        return ToeplitzExtractor()
+    if name in ("sha256", "shake_256"):
+        return HashConditioner(name)
+    raise ValueError("Unknown conditioner %s" % name)
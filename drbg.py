@@ -0,0 +1,91 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: Deterministic random bit generator (AES-256-CTR or ChaCha20 keystream) seeded and periodically reseeded
+from the camera, for when the camera's frame rate is too slow for the amount of random output needed
+"""
+import hashlib
+import logging
+import threading
+import time
+from Crypto.Cipher import AES, ChaCha20
+
+# default reseed limits, whichever comes first
+RESEED_BYTES = 1 << 24
+RESEED_INTERVAL = 60.0
+SEED_SIZE = 48
+
+
+class Drbg:
+    """
+    a keystream generator keyed from camera entropy. The key is replaced after every request with keystream the caller
+    never sees, so a leaked state doesn't reveal earlier output
+    """
+    def __init__(self, seed_fn=None, algorithm="aes", reseed_bytes=RESEED_BYTES, reseed_interval=RESEED_INTERVAL,
+                 seed: bytes = None):
+        """
+        :param seed_fn: function returning n full entropy bytes, used for seeding and reseeding
+        :param algorithm: aes (AES-256-CTR) or chacha20
+        :param reseed_bytes: reseed after this many output bytes
+        :param reseed_interval: reseed after this many seconds
+        :param seed: a fixed seed to use instead of seed_fn, such a generator never reseeds
+        """
+        assert algorithm in ("aes", "chacha20")
+        assert seed_fn is not None or seed is not None
+        self.seed_fn = seed_fn
+        self.algorithm = algorithm
+        self.reseed_bytes = reseed_bytes
+        self.reseed_interval = reseed_interval
+        self.lock = threading.Lock()
+        self.key = bytes(32)
+        self.cipher = None
+        self.generated = 0
+        self.seeded_at = 0.0
+        self.reseeds = 0
+        self.reseed(seed)
+
+    def _new_cipher(self, key: bytes):
+        """
+        create the keystream cipher for a key, with a zero nonce since every key is only used once
+        """
+        self.key = key
+        if self.algorithm == "aes":
+            self.cipher = AES.new(key, AES.MODE_CTR, nonce=bytes(8))
+        else:
+            self.cipher = ChaCha20.new(key=key, nonce=bytes(8))
+
+    def reseed(self, seed: bytes = None):
+        """
+        mix fresh entropy into the key
+        :param seed: seed bytes, taken from seed_fn if not given
+        """
+        if seed is None:
+            seed = self.seed_fn(SEED_SIZE)
+        with self.lock:
+            self._new_cipher(hashlib.sha256(self.key + seed).digest())
+            self.generated = 0
+            self.seeded_at = time.monotonic()
+            self.reseeds += 1
+        logging.debug("DRBG: Reseeded %s generator" % self.algorithm)
+
+    def _needs_reseed(self):
+        """
+        :return: whether one of the reseed limits was reached
+        """
+        if self.seed_fn is None:
+            return False
+        return self.generated >= self.reseed_bytes or time.monotonic() - self.seeded_at >= self.reseed_interval
+
+    def get_random_bytes(self, n: int):
+        """
+        generate n pseudo random bytes
+        :param n: number of bytes
+        :return: bytes object of length n
+        """
+        if self._needs_reseed():
+            self.reseed()
+        with self.lock:
+            stream = self.cipher.encrypt(bytes(n + 32))
+            self._new_cipher(stream[n:])
+            self.generated += n
+        return stream[:n]
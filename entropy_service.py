@@ -0,0 +1,388 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: Local entropy service - an asyncio daemon owning the frame source and entropy pool that serves random
+bytes and ints to other processes over a unix socket or TCP, and RemoteRandom, the client side Random talking to it
+"""
+import argparse
+import asyncio
+import logging
+import math
+import os
+import socket
+import struct
+import time
+import numpy as np
+from chaotic_source import Random
+from conditioning import get_conditioner
+from frame_source import source_from_spec
+
+# --------------------------- CONSTANTS ---------------------------
+DEFAULT_SOCKET = "/tmp/camerand.sock"
+DEFAULT_PORT = 20004
+SERVICE_ENV = "CAMERAND_SERVICE"
+MAX_REQUEST = 1 << 20
+QUOTA_RATE = 1 << 20
+QUOTA_BURST = 1 << 22
+
+# request: op, flags, request id, followed by the op's arguments
+REQUEST = struct.Struct("!BBI")
+# response: request id, status, payload length, followed by the payload
+RESPONSE = struct.Struct("!IBI")
+GET_BYTES = struct.Struct("!I")
+GET_INT = struct.Struct("!qq")
+INT = struct.Struct("!q")
+
+OP_BYTES = 1
+OP_INT = 2
+FLAG_FULL_ENTROPY = 1
+STATUS_OK = 0
+STATUS_QUOTA = 1
+STATUS_BAD_REQUEST = 2
+STATUS_ERROR = 3
+
+
+class ServiceError(RuntimeError):
+    """
+    raised by the client when the service refuses or fails a request
+    """
+    pass
+
+
+class Quota:
+    """
+    token bucket limiting the bytes a single client can take
+    """
+    def __init__(self, rate=QUOTA_RATE, burst=QUOTA_BURST):
+        """
+        :param rate: bytes per second added to the bucket
+        :param burst: size of the bucket
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def take(self, n: int):
+        """
+        :param n: requested bytes
+        :return: whether the client may take them
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if n > self.tokens:
+            return False
+        self.tokens -= n
+        return True
+
+    def full(self):
+        """
+        :return: whether the bucket has refilled completely, so forgetting it changes nothing
+        """
+        return self.tokens + (time.monotonic() - self.last) * self.rate >= self.burst
+
+
+class EntropyService:
+    """
+    the daemon, serves requests of every connection in order, so clients can pipeline many requests without waiting
+    """
+    def __init__(self, rand: Random, quota_rate=QUOTA_RATE, quota_burst=QUOTA_BURST):
+        """
+        :param rand: the RNG object all the randomness comes from
+        :param quota_rate: bytes per second each client may take
+        :param quota_burst: bytes each client may take at once
+        """
+        self.rand = rand
+        self.quota_rate = quota_rate
+        self.quota_burst = quota_burst
+        self.clients = 0
+        self.served = 0
+        # quotas outlive connections, so reconnecting doesn't refill a client's bucket. Peer processes' buckets are
+        # keyed on their pid, and buckets of connected peers with no pid (TCP) are kept for the next connection from
+        # the same host once they leave. Either is dropped once unused and full again
+        self.quotas = {}
+        self.connections = {}
+
+    async def _handle_request(self, op, flags, reader, quota):
+        """
+        read a request's arguments and run it
+        :return: (status, payload)
+        """
+        loop = asyncio.get_running_loop()
+        full_entropy = bool(flags & FLAG_FULL_ENTROPY)
+        if op == OP_BYTES:
+            n, = GET_BYTES.unpack(await reader.readexactly(GET_BYTES.size))
+            if n > MAX_REQUEST:
+                return STATUS_BAD_REQUEST, b""
+            if not quota.take(n):
+                return STATUS_QUOTA, b""
+            # the pool might have to wait for the camera, so it is read off the event loop
+            data = await loop.run_in_executor(None, self.rand.get_random_bytes, n, full_entropy)
+            self.served += n
+            return STATUS_OK, data
+        if op == OP_INT:
+            lo, hi = GET_INT.unpack(await reader.readexactly(GET_INT.size))
+            if lo > hi:
+                return STATUS_BAD_REQUEST, b""
+            if not quota.take(INT.size):
+                return STATUS_QUOTA, b""
+            num = await loop.run_in_executor(None, self.rand.get_int_range, lo, hi)
+            self.served += INT.size
+            return STATUS_OK, INT.pack(num)
+        return STATUS_BAD_REQUEST, b""
+
+    def _peer(self, writer: asyncio.StreamWriter):
+        """
+        :return: ("pid", pid) for a unix socket peer, ("host", address) for a TCP one, ("unix", None) if the unix
+        socket can't tell the peer's pid (SO_PEERCRED is linux only)
+        """
+        peer = writer.get_extra_info("peername")
+        if isinstance(peer, tuple):
+            return "host", peer[0]
+        try:
+            creds = writer.get_extra_info("socket").getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                                               struct.calcsize("3i"))
+        except (AttributeError, OSError):
+            return "unix", None
+        return "pid", struct.unpack("3i", creds)[0]
+
+    def _quota(self, key):
+        """
+        get the quota of a new connection
+        :param key: the peer, from _peer
+        :return: Quota
+        """
+        if key[0] == "pid":
+            # every connection of a process shares its bucket
+            quota = self.quotas.setdefault(key, Quota(self.quota_rate, self.quota_burst))
+        else:
+            # each connection has its own bucket, starting from the one the last connection from the host left
+            quota = self.quotas.pop(key, None) or Quota(self.quota_rate, self.quota_burst)
+        self.connections[quota] = self.connections.get(quota, 0) + 1
+        return quota
+
+    def _release(self, key, quota):
+        """
+        give a connection's quota back when it disconnects, and forget the buckets no one needs anymore
+        :param key: the peer, from _peer
+        :param quota: the connection's quota
+        """
+        self.connections[quota] -= 1
+        if not self.connections[quota]:
+            del self.connections[quota]
+        if key[0] != "pid":
+            # a later connection from the host starts from the emptier of the buckets its connections left
+            left = self.quotas.get(key)
+            if left is None or quota.tokens < left.tokens:
+                self.quotas[key] = quota
+        for key, quota in list(self.quotas.items()):
+            if quota not in self.connections and quota.full():
+                del self.quotas[key]
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        connection handler, reads requests until the client disconnects
+        """
+        self.clients += 1
+        logging.info("EntropyService: New client, %d connected" % self.clients)
+        key = quota = None
+        try:
+            key = self._peer(writer)
+            quota = self._quota(key)
+            while True:
+                try:
+                    op, flags, req_id = REQUEST.unpack(await reader.readexactly(REQUEST.size))
+                except asyncio.IncompleteReadError:
+                    break
+                try:
+                    status, payload = await self._handle_request(op, flags, reader, quota)
+                except asyncio.IncompleteReadError:
+                    break
+                except Exception:
+                    logging.exception("EntropyService: Request failed")
+                    status, payload = STATUS_ERROR, b""
+                writer.write(RESPONSE.pack(req_id, status, len(payload)) + payload)
+                # drain only blocks when the client stops reading its responses
+                await writer.drain()
+                if status == STATUS_BAD_REQUEST and op not in (OP_BYTES, OP_INT):
+                    # an unknown op has unknown arguments, the stream can't be parsed any further
+                    break
+        finally:
+            self.clients -= 1
+            if quota is not None:
+                self._release(key, quota)
+            writer.close()
+            logging.info("EntropyService: Client left, %d connected" % self.clients)
+
+    async def serve(self, path=None, host=None, port=DEFAULT_PORT):
+        """
+        serve forever on a unix socket, or on TCP if host is given
+        :param path: unix socket path
+        :param host: TCP host to listen on
+        :param port: TCP port
+        """
+        if host is not None:
+            server = await asyncio.start_server(self.handle, host, port)
+            logging.info("EntropyService: Listening on %s:%d" % (host, port))
+        else:
+            server = await asyncio.start_unix_server(self.handle, path or DEFAULT_SOCKET)
+            logging.info("EntropyService: Listening on %s" % (path or DEFAULT_SOCKET))
+        async with server:
+            await server.serve_forever()
+
+
+class RemoteRandom(Random):
+    """
+    a Random whose randomness comes from the entropy service instead of a local camera, with the same API
+    """
+    def __init__(self, path=None, host=None, port=DEFAULT_PORT):
+        """
+        :param path: unix socket path of the service, the default path if neither path nor host are given
+        :param host: TCP host of the service
+        :param port: TCP port of the service
+        """
+        self.address = (host, port) if host is not None else (path or DEFAULT_SOCKET)
+        self.sock = None
+        self.req_id = 0
+        self.cont()
+
+    def __del__(self):
+        self.pause()
+
+    def pause(self):
+        """
+        disconnect from the service
+        """
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def cont(self):
+        """
+        connect to the service
+        """
+        if self.sock is None:
+            family = socket.AF_INET if isinstance(self.address, tuple) else socket.AF_UNIX
+            self.sock = socket.socket(family, socket.SOCK_STREAM)
+            self.sock.connect(self.address)
+            logging.debug("RemoteRandom: Connected to %s" % str(self.address))
+
+    def _recv_exact(self, n: int):
+        """
+        read exactly n bytes from the service
+        """
+        data = bytearray()
+        while len(data) < n:
+            part = self.sock.recv(n - len(data))
+            if not part:
+                raise ServiceError("Entropy service closed the connection")
+            data += part
+        return bytes(data)
+
+    def _requests(self, requests: list):
+        """
+        send several requests at once and read all their responses (pipelining)
+        :param requests: list of (op, flags, packed arguments)
+        :return: list of payloads, in the order of the requests
+        """
+        ids = []
+        out = b""
+        for op, flags, args in requests:
+            self.req_id = (self.req_id + 1) % (1 << 32)
+            ids.append(self.req_id)
+            out += REQUEST.pack(op, flags, self.req_id) + args
+        self.sock.sendall(out)
+        payloads = []
+        error = None
+        try:
+            # every response is read even after a failed one, so the next batch doesn't get this one's leftovers
+            for req_id in ids:
+                res_id, status, length = RESPONSE.unpack(self._recv_exact(RESPONSE.size))
+                payload = self._recv_exact(length)
+                if res_id != req_id:
+                    raise ServiceError("Entropy service answered request %d instead of %d" % (res_id, req_id))
+                if error is None and status == STATUS_QUOTA:
+                    error = ServiceError("Entropy service quota exceeded")
+                elif error is None and status != STATUS_OK:
+                    error = ServiceError("Entropy service failed the request (status %d)" % status)
+                payloads.append(payload)
+        except (OSError, ServiceError):
+            # the connection is out of sync or gone, drop it so cont() starts a fresh one
+            self.pause()
+            raise
+        if error is not None:
+            raise error
+        return payloads
+
+    def get_random_bytes(self, n: int, full_entropy=False):
+        """
+        Get n random bytes from the service, split into pipelined requests if n is large
+        :param n: number of bytes
+        :param full_entropy: skip the service's drbg if it runs in drbg mode
+        :return: bytes object of length n
+        """
+        flags = FLAG_FULL_ENTROPY if full_entropy else 0
+        sizes = [min(MAX_REQUEST, n - i) for i in range(0, n, MAX_REQUEST)]
+        return b"".join(self._requests([(OP_BYTES, flags, GET_BYTES.pack(size)) for size in sizes]))
+
+    def _entropy_bytes(self, n: int):
+        return self.get_random_bytes(n, full_entropy=True)
+
+    def get_random_array(self, rang: int, full_entropy=False):
+        data = np.frombuffer(self.get_random_bytes(math.ceil(rang / 8), full_entropy), dtype=np.uint8)
+        return np.unpackbits(data)[:rang]
+
+    def get_int_range(self, start: int, stop: int):
+        """
+        Get a random int between start and end, drawn by the service when the range fits its 64-bit request
+        :param start: start
+        :param stop: end
+        :return: a random int between start and end
+        """
+        if -(1 << 63) <= start <= stop < 1 << 63 and stop - start < 1 << 63:
+            return INT.unpack(self._requests([(OP_INT, 0, GET_INT.pack(start, stop))])[0])[0]
+        return super().get_int_range(start, stop)
+
+
+def get_random():
+    """
+    get the RNG object tools should use - a RemoteRandom if CAMERAND_SERVICE points at a running entropy service
+    (unix:<path> or tcp:<host>:<port>), a local Random on the shared camera otherwise
+    :return: RNG object
+    """
+    spec = os.environ.get(SERVICE_ENV)
+    if not spec:
+        return Random()
+    kind, _, arg = spec.partition(":")
+    if kind == "tcp":
+        host, _, port = arg.rpartition(":")
+        return RemoteRandom(host=host, port=int(port))
+    return RemoteRandom(arg or DEFAULT_SOCKET)
+
+
+def main():
+    """
+    run the entropy service from the command line
+    """
+    parser = argparse.ArgumentParser(description="CameRAND local entropy service")
+    parser.add_argument("--unix", default=DEFAULT_SOCKET, help="unix socket path")
+    parser.add_argument("--host", help="serve over TCP on this host instead of a unix socket")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--source", default="camera", help="frame source spec, e.g. camera:0 or synthetic:1")
+    parser.add_argument("--mode", default="entropy", choices=("entropy", "drbg"))
+    parser.add_argument("--conditioner", default="none")
+    parser.add_argument("--quota-rate", type=int, default=QUOTA_RATE, help="bytes per second per client")
+    parser.add_argument("--quota-burst", type=int, default=QUOTA_BURST, help="bytes per client at once")
+    args = parser.parse_args()
+    rand = Random(source_from_spec(args.source), mode=args.mode, conditioner=get_conditioner(args.conditioner))
+    service = EntropyService(rand, args.quota_rate, args.quota_burst)
+    try:
+        asyncio.run(service.serve(args.unix, args.host, args.port))
+    finally:
+        rand.pause()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename="entropy_service.log", level=logging.INFO)
+    main()
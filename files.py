@@ -6,12 +6,11 @@ description: A file concentrating all functions that access files, write/read/cr
 import logging
 from os.path import join
 from Crypto.PublicKey import RSA
-from pickle import dump, load
-from chaotic_source import Random
-from RSA import get_prime, rsa
-from threading import Event
+from entropy_service import get_random
+from RSA import DEFAULT_KEY_SIZE, rsa
+from prime_engine import get_engine
+from prime_store import PrimeStore
 import cv2
-from tkinter.filedialog import asksaveasfilename
 
 
 def public_key(modulus, exponent, dir):
@@ -47,13 +46,26 @@ def private_key(modulus, exponent, priv_exp, p, q, dir):
     logging.debug("Files: Saved private key")
 
 
-def keygen(dir):
+def key_files(p, q):
+    """
+    a function to build a key pair's files in memory, for writing many keys at once
+    :param p: prime 1
+    :param q: prime 2
+    :return: dict of file name (id_rsa, id_rsa.pub) to contents
+    """
+    n, e, d = rsa(p, q)
+    key = RSA.construct((n, e, d, p, q))
+    return {"id_rsa": key.exportKey(), "id_rsa.pub": key.publickey().exportKey(format='OpenSSH')}
+
+
+def keygen(dir, key_size=DEFAULT_KEY_SIZE):
     """
     a function to call each step in key generation in order
     :param dir: where to save the keys
+    :param key_size: RSA key size, one of RSA.KEY_PROFILES
     """
-    logging.debug("Files: Requesting primes for RSA keygen")
-    p, q = get_primes()
+    logging.debug("Files: Requesting primes for %d bit RSA keygen" % key_size)
+    p, q = get_primes(key_size)
     n, e, d = rsa(p, q)
     logging.debug("Files: Successfully created key pair")
     public_key(n, e, dir)
@@ -61,72 +73,33 @@ def keygen(dir):
     logging.debug("Files: Successfully saved key pair")
 
 
-def add_prime(num):
-    """
-    a function to insert a prime number into the prime list, primes.bin
-    :param num: number to insert
+def get_primes(key_size=DEFAULT_KEY_SIZE):
     """
-    logging.debug("Files: adding prime %d to file" % num)
-    with open("primes.bin", "rb") as file:
-        primes = load(file)
-    primes.append(num)
-    with open("primes.bin", "wb") as file:
-        dump(primes, file)
-
-
-def get_primes():
-    """
-    A function that returns two primes, either from primes.bin or if unavailable generate them on the spot
+    A function that returns two primes, either from the prime store or if unavailable generate them on the spot
+    :param key_size: RSA key size the primes are for, each key size has its own store
     :return: two prime numbers
     """
     logging.debug("Files: 2 primes requested")
-    rand = Random()
-    with open("primes.bin", "rb") as file:
-        primes = load(file)
-    if len(primes) >= 2:
-        logging.debug("Files: Found 2 primes in file")
-        a, b = primes.pop(0), primes.pop(1)
-        with open("primes.bin", "wb") as file:
-            dump(primes, file)
-    elif len(primes) == 1:
-        logging.debug("Files: Found only 1 prime in file, requesting another")
-        a = primes.pop(0)
-        b = get_prime(rand)
-        with open("primes.bin", "wb") as file:
-            dump([], file)
-    else:
-        logging.debug("Files: File is empty, requesting both primes")
-        a = get_prime(rand)
-        b = get_prime(rand)
-    rand.pause()
+    found = PrimeStore(key_size).take(2)
+    logging.debug("Files: Found %d primes in file" % len(found))
+    if len(found) < 2:
+        logging.debug("Files: Requesting %d more primes" % (2 - len(found)))
+        rand = get_random()
+        found += get_engine().get_primes(rand, 2 - len(found), key_size=key_size)
+        rand.pause()
+    a, b = found
     logging.debug("Files: Successfully received 2 primes")
     return a, b
 
 
-def idle_prime(event: Event):
-    """
-    A thread loop function to get large numbers, check their primality using a miller-rabin test and insert them in the
-    list, in the background of the code
-    :param event: a flag to check if the thread should stop
-    """
-    logging.debug("Files: Started idle prime search")
-    rand = Random()
-    inc = 0
-    while True:
-        num = get_prime(rand)
-        add_prime(num)
-        inc += 1
-        if event.is_set():
-            logging.debug("Files: Finished idle prime search, found %d primes" % inc)
-            return
-
-
 def save_image(im):
     """
     a function to get an image's save path and save it there
     :param im: a numpy array containing an image
     """
     logging.debug("Files: Saving random image")
+    # imported here so the key functions work on machines without a display or tkinter
+    from tkinter.filedialog import asksaveasfilename
     save_path = asksaveasfilename(defaultextension='.png',
                                   filetypes=[("png Files", "*.png")], title="Choose location")
     cv2.imwrite(save_path, cv2.imread(im))
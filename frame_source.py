@@ -0,0 +1,370 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: Frame sources for the TRNG. The camera and its headless stand-ins (video files, image directories,
+seeded synthetic noise and replayed recordings) all share the same small interface, so Random doesn't care where its
+frames come from
+"""
+import glob
+import logging
+from abc import ABC, abstractmethod
+import os
+import struct
+import sys
+import time
+import cv2
+import numpy as np
+
+# environment variable holding a source spec, used when no source is given explicitly
+SOURCE_ENV = "CAMERAND_SOURCE"
+# recordings have a fixed size .npy header so the frame count can be rewritten in place
+NPY_HEADER = 128
+
+
+class FrameSource(ABC):
+    """
+    base class for every frame source, modeled after cv2.VideoCapture (read returns a (check, frame) pair)
+    """
+    @abstractmethod
+    def open(self):
+        """
+        open the source, called on creation of a Random object and when it is continued after a pause
+        """
+        pass
+
+    @abstractmethod
+    def read(self):
+        """
+        read the next frame
+        :return: (success, BGR frame as a uint8 array)
+        """
+        pass
+
+    @abstractmethod
+    def release(self):
+        """
+        release the source so another object can use it
+        """
+        pass
+
+    @abstractmethod
+    def is_opened(self):
+        """
+        :return: whether the source is open and can be read from
+        """
+        pass
+
+
+def default_backend():
+    """
+    get the OpenCV capture backend that fits the current OS
+    :return: DirectShow on windows, V4L2 on linux and whatever OpenCV picks anywhere else
+    """
+    if sys.platform.startswith("win"):
+        return cv2.CAP_DSHOW
+    if sys.platform.startswith("linux"):
+        return cv2.CAP_V4L2
+    return cv2.CAP_ANY
+
+
+class CameraSource(FrameSource):
+    """
+    a camera read through OpenCV, the actual chaotic source
+    """
+    def __init__(self, index=0, backend=None):
+        """
+        :param index: camera device index
+        :param backend: OpenCV capture backend (cv2.CAP_*), defaults to the OS's native backend
+        """
+        self.index = index
+        self.backend = default_backend() if backend is None else backend
+        self.cam = None
+
+    def open(self):
+        logging.debug("FrameSource: Opening camera %d" % self.index)
+        self.cam = cv2.VideoCapture(self.index, self.backend)
+
+    def read(self):
+        if self.cam is None:
+            return False, None
+        return self.cam.read()
+
+    def release(self):
+        if self.cam is not None:
+            self.cam.release()
+            self.cam = None
+
+    def is_opened(self):
+        return self.cam is not None and self.cam.isOpened()
+
+
+class VideoFileSource(FrameSource):
+    """
+    a recorded video file, replayed frame by frame
+    """
+    def __init__(self, path, loop=True):
+        """
+        :param path: path to the video file
+        :param loop: start over when the video ends instead of failing
+        """
+        self.path = path
+        self.loop = loop
+        self.cap = None
+
+    def open(self):
+        logging.debug("FrameSource: Opening video file %s" % self.path)
+        self.cap = cv2.VideoCapture(self.path)
+
+    def read(self):
+        if self.cap is None:
+            return False, None
+        check, frame = self.cap.read()
+        if not check and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            check, frame = self.cap.read()
+        return check, frame
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    def is_opened(self):
+        return self.cap is not None and self.cap.isOpened()
+
+
+class ImageDirSource(FrameSource):
+    """
+    a directory of still images, read in name order
+    """
+    def __init__(self, path, pattern="*.png", loop=True):
+        """
+        :param path: directory holding the images
+        :param pattern: glob pattern of the image files in the directory
+        :param loop: start over after the last image instead of failing
+        """
+        self.path = path
+        self.pattern = pattern
+        self.loop = loop
+        self.files = []
+        self.place = 0
+
+    def open(self):
+        logging.debug("FrameSource: Opening image directory %s" % self.path)
+        self.files = sorted(glob.glob(os.path.join(self.path, self.pattern)))
+        self.place = 0
+
+    def read(self):
+        if self.place >= len(self.files):
+            if not self.loop or not self.files:
+                return False, None
+            self.place = 0
+        frame = cv2.imread(self.files[self.place])
+        self.place += 1
+        return frame is not None, frame
+
+    def release(self):
+        self.files = []
+
+    def is_opened(self):
+        return bool(self.files)
+
+
+class SyntheticSource(FrameSource):
+    """
+    seeded uniform noise frames, NOT a chaotic source. Only meant for tests and benchmarks on machines without a camera
+    """
+    def __init__(self, seed=None, shape=(480, 640, 3)):
+        """
+        :param seed: seed for the noise generator, the same seed always gives the same frames
+        :param shape: shape of the generated BGR frames
+        """
+        self.seed = seed
+        self.shape = shape
+        self.gen = None
+
+    def open(self):
+        # reopening after a pause continues the same stream rather than replaying it
+        if self.gen is None:
+            logging.debug("FrameSource: Opening synthetic source with seed %s" % self.seed)
+            self.gen = np.random.default_rng(self.seed)
+
+    def read(self):
+        if self.gen is None:
+            return False, None
+        return True, self.gen.integers(0, 256, self.shape, dtype=np.uint8)
+
+    def release(self):
+        pass
+
+    def is_opened(self):
+        return self.gen is not None
+
+
+def npy_header(shape, dtype):
+    """
+    build a .npy (version 1.0) header padded to exactly NPY_HEADER bytes
+    :param shape: array shape
+    :param dtype: array dtype
+    :return: the header bytes
+    """
+    desc = "{'descr': '%s', 'fortran_order': False, 'shape': %s, }" % (np.dtype(dtype).str, repr(tuple(shape)))
+    desc = desc.ljust(NPY_HEADER - 11) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(desc)) + desc.encode()
+
+
+class RecordingSource(FrameSource):
+    """
+    wraps another source and records every frame read from it into a .npy stack (plus a .times.npy file of capture
+    times), so a run can be replayed later with ReplaySource
+    """
+    def __init__(self, source: FrameSource, path):
+        """
+        :param source: the source to record
+        :param path: path of the .npy recording, the capture times are saved next to it
+        """
+        self.source = source
+        self.path = path
+        self.file = None
+        self.shape = None
+        self.dtype = None
+        self.times = []
+
+    def open(self):
+        self.source.open()
+        if self.file is None:
+            # a paused recording continues where it stopped
+            self.file = open(self.path, "r+b" if self.shape is not None else "wb")
+            self.file.seek(0, os.SEEK_END)
+
+    def read(self):
+        check, frame = self.source.read()
+        if check and frame is not None and self.file is not None:
+            if self.shape is None:
+                self.shape, self.dtype = frame.shape, frame.dtype
+                self.file.write(npy_header((0,) + self.shape, self.dtype))
+            elif frame.shape != self.shape:
+                raise ValueError("Can't record frames of changing shape %s != %s" % (frame.shape, self.shape))
+            self.file.write(np.ascontiguousarray(frame).tobytes())
+            self.times.append(time.monotonic())
+        return check, frame
+
+    def release(self):
+        self.source.release()
+        if self.file is not None:
+            if self.shape is not None:
+                self.file.seek(0)
+                self.file.write(npy_header((len(self.times),) + self.shape, self.dtype))
+                np.save(self.times_path(self.path), np.array(self.times) - self.times[0])
+            self.file.close()
+            self.file = None
+            logging.debug("FrameSource: Recorded %d frames to %s" % (len(self.times), self.path))
+
+    def is_opened(self):
+        return self.source.is_opened()
+
+    @staticmethod
+    def times_path(path):
+        """
+        :param path: path of a recording
+        :return: path of the recording's capture times
+        """
+        return os.path.splitext(path)[0] + ".times.npy"
+
+
+class ReplaySource(FrameSource):
+    """
+    replays a recording made by RecordingSource straight from a memory map, as fast as possible or at the original
+    frame timing
+    """
+    def __init__(self, path, realtime=False, loop=False):
+        """
+        :param path: path of the .npy recording
+        :param realtime: wait between frames as long as the camera did
+        :param loop: start over after the last frame instead of failing
+        """
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.frames = None
+        self.times = None
+        self.place = 0
+        self.start = 0.0
+
+    def open(self):
+        if self.frames is None:
+            logging.debug("FrameSource: Opening recording %s" % self.path)
+            self.frames = np.load(self.path, mmap_mode="r")
+            times_path = RecordingSource.times_path(self.path)
+            self.times = np.load(times_path) if os.path.exists(times_path) else np.zeros(len(self.frames))
+            self.place = 0
+            self.start = time.monotonic()
+
+    def read(self):
+        if self.frames is None:
+            return False, None
+        if self.place >= len(self.frames):
+            if not self.loop or not len(self.frames):
+                return False, None
+            self.place = 0
+            self.start = time.monotonic()
+        if self.realtime:
+            delay = self.start + self.times[self.place] - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        frame = self.frames[self.place]
+        self.place += 1
+        return True, frame
+
+    def release(self):
+        self.frames = None
+
+    def is_opened(self):
+        return self.frames is not None
+
+
+def source_from_spec(spec: str):
+    """
+    build a frame source from a short text spec, used by command line tools and the CAMERAND_SOURCE variable.
+    specs: camera[:index], synthetic[:seed], video:path, images:dir, replay:path, replay-realtime:path
+    :param spec: the spec string
+    :return: an unopened frame source
+    """
+    kind, _, arg = spec.partition(":")
+    if kind == "camera":
+        return CameraSource(int(arg) if arg else 0)
+    if kind == "synthetic":
+        return SyntheticSource(int(arg) if arg else None)
+    if kind == "video":
+        return VideoFileSource(arg)
+    if kind == "images":
+        return ImageDirSource(arg)
+    if kind == "replay":
+        return ReplaySource(arg)
+    if kind == "replay-realtime":
+        return ReplaySource(arg, realtime=True)
+    raise ValueError("Unknown frame source %s" % spec)
+
+
+def default_source():
+    """
+    get the source used when none is given, the camera unless CAMERAND_SOURCE says otherwise
+    :return: an unopened frame source
+    """
+    spec = os.environ.get(SOURCE_ENV)
+    if spec:
+        logging.info("FrameSource: Using %s from %s" % (spec, SOURCE_ENV))
+        return source_from_spec(spec)
+    return CameraSource()
+
+
+if __name__ == '__main__':
+    # record frames for later replay: python frame_source.py <source spec> <output .npy> <number of frames>
+    logging.basicConfig(level=logging.INFO)
+    recorder = RecordingSource(source_from_spec(sys.argv[1]), sys.argv[2])
+    recorder.open()
+    for i in range(int(sys.argv[3])):
+        if not recorder.read()[0]:
+            logging.error("FrameSource: Source stopped after %d frames" % i)
+            break
+    recorder.release()
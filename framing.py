@@ -0,0 +1,264 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: Message framing for the chat protocol. Version 1 is the original 3-digit ASCII length format, version 2
+frames every message with a type byte and a 32 bit length. Both are parsed incrementally, so frames split over
+several reads or coalesced into one are handled, and peers agree on a version with a hello when connecting
+"""
+import socket
+import struct
+
+VERSION = 2
+# the version clients ask for unless told otherwise. Servers from before negotiation try to parse the hello as a
+# message length and drop the client, so clients stay on version 1 until every server speaks version 2
+CLIENT_VERSION = 1
+# a version 2 peer opens the connection with the hello followed by the highest version byte it speaks, and the server
+# answers with the hello and the version chosen. Version 1 peers never send it
+HELLO = b"%hi"
+# version 2 frame header: type, payload length
+HEADER = struct.Struct("!BI")
+MAX_FRAME = 1 << 20
+# message kinds and their version 2 type bytes
+KINDS = {"text": 1, "bin": 2, "key": 3, "end": 4, "name": 5}
+V1_MAX = 999
+
+
+class FrameError(ValueError):
+    """
+    a malformed or oversized frame, the connection can't be trusted to be in sync after it
+    """
+    pass
+
+
+def encode_v1(line, pre=""):
+    """
+    Encodes message according to the version 1 protocol (length prefix and type prefix)
+    :param line: line to encode
+    :param pre: prefix to add to the message for special messages like key and name
+    :return: protocol encoded message
+    """
+    if len(line) > V1_MAX:
+        raise FrameError("Message of %d bytes is too long for protocol version 1" % len(line))
+    if pre == 'bin':
+        return (pre + str(len(line)).zfill(3)).encode() + line
+    return (pre + str(len(line)).zfill(3) + line).encode()  # add a 3-digit length prefix
+
+
+def encode(kind, payload=None, version=VERSION):
+    """
+    encode a message
+    :param kind: message kind, one of KINDS
+    :param payload: str for text messages, bytes for bin messages, None for the rest
+    :param version: protocol version
+    :return: the encoded frame
+    """
+    if version == 1:
+        if kind == "text":
+            return encode_v1(payload)
+        if kind == "bin":
+            return encode_v1(payload, "bin")
+        return {"key": b"%pk003key", "end": b"end000", "name": b"%in"}[kind]
+    data = b"" if payload is None else payload.encode() if kind == "text" else payload
+    if len(data) > MAX_FRAME:
+        raise FrameError("Message of %d bytes is over the %d byte frame limit" % (len(data), MAX_FRAME))
+    return HEADER.pack(KINDS[kind], len(data)) + data
+
+
+class V1Decoder:
+    """
+    incremental parser of the version 1 protocol. Messages start with a 3 character header: a 3-digit length of a
+    text message, "bin" and a 3-digit length of a binary one, "%pk" followed by "003key" for a public key request,
+    "%in" for a name message or "end" for a disconnect (sent as "end000")
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """
+        add received bytes
+        :param data: the bytes
+        :return: list of (kind, payload) of every message completed, the payload is a str for text messages, bytes for
+        bin messages and None for the rest
+        """
+        self.buffer += data
+        messages = []
+        while True:
+            message = self._next()
+            if message is None:
+                return messages
+            messages.append(message)
+
+    def _next(self):
+        """
+        take a single message off the buffer
+        :return: (kind, payload), or None if the buffer doesn't hold a whole message yet
+        """
+        buf = self.buffer
+        if len(buf) < 3:
+            return None
+        head = bytes(buf[:3])
+        if head == b"%pk":
+            if len(buf) < 9:
+                return None
+            if buf[3:9] != b"003key":
+                raise FrameError("Bad public key request %r" % bytes(buf[:9]))
+            del buf[:9]
+            return "key", None
+        if head == b"%in":
+            del buf[:3]
+            return "name", None
+        if head == b"end":
+            # the length that follows is always 000
+            if len(buf) < 6:
+                return None
+            del buf[:6]
+            return "end", None
+        if head == b"bin":
+            if len(buf) < 6:
+                return None
+            if not bytes(buf[3:6]).isdigit():
+                raise FrameError("Bad message length %r" % bytes(buf[3:6]))
+            length = int(buf[3:6])
+            if len(buf) < 6 + length:
+                return None
+            payload = bytes(buf[6:6 + length])
+            del buf[:6 + length]
+            return "bin", payload
+        if not head.isdigit():
+            raise FrameError("Bad message header %r" % head)
+        length = int(head)
+        if len(buf) < 3 + length:
+            return None
+        payload = bytes(buf[3:3 + length]).decode()
+        del buf[:3 + length]
+        return "text", payload
+
+
+class FrameDecoder(V1Decoder):
+    """
+    incremental parser of the version 2 protocol
+    """
+    def __init__(self, max_frame=MAX_FRAME):
+        """
+        :param max_frame: largest payload accepted, anything larger is an error rather than a reason to buffer it
+        """
+        super().__init__()
+        self.max_frame = max_frame
+        self.types = {value: kind for kind, value in KINDS.items()}
+
+    def _next(self):
+        buf = self.buffer
+        if len(buf) < HEADER.size:
+            return None
+        kind, length = HEADER.unpack_from(buf)
+        if kind not in self.types:
+            raise FrameError("Unknown frame type %d" % kind)
+        if length > self.max_frame:
+            raise FrameError("Frame of %d bytes is over the %d byte limit" % (length, self.max_frame))
+        if len(buf) < HEADER.size + length:
+            return None
+        payload = bytes(buf[HEADER.size:HEADER.size + length])
+        del buf[:HEADER.size + length]
+        kind = self.types[kind]
+        if kind == "text":
+            return kind, payload.decode()
+        return kind, payload if kind == "bin" else None
+
+
+def get_decoder(version, max_frame=MAX_FRAME):
+    """
+    :param version: protocol version
+    :param max_frame: largest payload accepted by version 2
+    :return: a new decoder for the version
+    """
+    return V1Decoder() if version == 1 else FrameDecoder(max_frame)
+
+
+def recv_exact(sock: socket.socket, n):
+    """
+    read exactly n bytes, however many recv calls it takes
+    :param sock: socket to read from
+    :param n: number of bytes
+    :return: the bytes, shorter only if the connection was closed
+    """
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return bytes(data)
+
+
+class FramedSocket:
+    """
+    a blocking socket speaking one protocol version, returning whole messages however the bytes arrive
+    """
+    def __init__(self, sock: socket.socket, version=VERSION, max_frame=MAX_FRAME):
+        """
+        :param sock: connected socket
+        :param version: protocol version agreed on
+        :param max_frame: largest payload accepted by version 2
+        """
+        self.sock = sock
+        self.version = version
+        self.decoder = get_decoder(version, max_frame)
+        self.messages = []
+
+    def send(self, kind, payload=None):
+        """
+        send a message
+        :param kind: message kind, one of KINDS
+        :param payload: str for text messages, bytes for bin messages, None for the rest
+        """
+        self.sock.sendall(encode(kind, payload, self.version))
+
+    def pending(self):
+        """
+        :return: whether a whole message was already received and is waiting to be read
+        """
+        return bool(self.messages)
+
+    def recv(self):
+        """
+        read the next message, blocking until it arrives
+        :return: (kind, payload), or (None, None) if the connection was closed
+        """
+        while not self.messages:
+            data = self.sock.recv(1 << 16)
+            if not data:
+                return None, None
+            self.messages.extend(self.decoder.feed(data))
+        return self.messages.pop(0)
+
+
+def negotiate(sock: socket.socket, version=CLIENT_VERSION, max_frame=MAX_FRAME):
+    """
+    client side version negotiation, version 1 skips it so old servers are never sent a hello
+    :param sock: socket connected to the server
+    :param version: highest protocol version to use
+    :param max_frame: largest payload accepted by version 2
+    :return: FramedSocket speaking the version agreed on
+    """
+    if version > 1:
+        sock.sendall(HELLO + bytes([version]))
+        answer = recv_exact(sock, len(HELLO) + 1)
+        if len(answer) != len(HELLO) + 1 or answer[:len(HELLO)] != HELLO:
+            raise FrameError("Server didn't answer the protocol hello")
+        version = answer[-1]
+    return FramedSocket(sock, version, max_frame)
+
+
+def accept_version(data: bytes):
+    """
+    server side version negotiation, on the first bytes a client sent
+    :param data: the first bytes received, at least len(HELLO) + 1 of them unless the client sent less
+    :return: (version, answer to send back or b"" for version 1, the bytes after the hello), or None if more bytes
+    are needed to tell
+    """
+    if data[:len(HELLO)] != HELLO[:len(data)]:
+        return 1, b"", data
+    if len(data) <= len(HELLO):
+        return None
+    version = max(1, min(VERSION, data[len(HELLO)]))
+    return version, HELLO + bytes([version]), data[len(HELLO) + 1:]
@@ -0,0 +1,194 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: Harvesting modes deciding which raw bits are taken out of the camera frames - the grayscale LSB of one
+frame, low bits of every colour channel, or the temporal noise between consecutive frames - with a min-entropy
+estimate to compare them on a given sensor
+"""
+import logging
+import math
+from abc import ABC, abstractmethod
+import sys
+import time
+import cv2
+import numpy as np
+from frame_source import FrameSource, source_from_spec
+
+
+def low_bits(values: np.ndarray, bits: int):
+    """
+    pack the low-order bits of every value into bytes
+    :param values: uint8 array
+    :param bits: number of low-order bits kept per value (1-8)
+    :return: packed bytes
+    """
+    if bits == 1:
+        return np.packbits(np.bitwise_and(values, 1)).tobytes()
+    return np.packbits(np.unpackbits(values.reshape(-1, 1), axis=1)[:, 8 - bits:]).tobytes()
+
+
+def min_entropy(symbols: np.ndarray, bits: int):
+    """
+    most common value min-entropy estimate (SP 800-90B 6.3.1) per bit, taking the lower of the estimate on single
+    symbols and on pairs of neighbouring symbols so correlation between neighbours lowers it too
+    :param symbols: array of symbols
+    :param bits: bits per symbol
+    :return: estimated min-entropy per bit, between 0 and 1
+    """
+    symbols = symbols.ravel().astype(np.uint32) & ((1 << bits) - 1)
+    pairs = symbols[:len(symbols) // 2 * 2].reshape(-1, 2)
+    estimates = []
+    for data, width in ((symbols, bits), ((pairs[:, 0] << bits) | pairs[:, 1], 2 * bits)):
+        if len(data) < 2:
+            continue
+        p_hat = np.bincount(data).max() / len(data)
+        # upper bound of the 99% confidence interval of the most common value's probability
+        p_u = min(1.0, p_hat + 2.576 * math.sqrt(p_hat * (1 - p_hat) / (len(data) - 1)))
+        estimates.append(-math.log2(p_u) / width)
+    return min(estimates) if estimates else 0.0
+
+
+class Harvester(ABC):
+    """
+    base class for harvesting modes, turns frames into raw packed bits
+    """
+    name = "none"
+    frames = 1
+    bits = 1
+
+    @abstractmethod
+    def samples(self, frames: list):
+        """
+        get the noise samples of some frames
+        :param frames: list of self.frames BGR frames
+        :return: uint8 array of samples
+        """
+        pass
+
+    def harvest(self, frames: list):
+        """
+        :param frames: list of self.frames BGR frames
+        :return: raw bits packed into bytes
+        """
+        return low_bits(self.samples(frames), self.bits)
+
+    def estimate(self, frames: list):
+        """
+        :param frames: list of self.frames BGR frames
+        :return: estimated min-entropy per raw bit
+        """
+        return min_entropy(self.samples(frames), self.bits)
+
+
+class LsbHarvester(Harvester):
+    """
+    the LSB of every grayscale pixel of one frame, the original harvesting mode
+    """
+    name = "lsb"
+    bits = 1
+
+    def samples(self, frames: list):
+        return cv2.cvtColor(frames[0], cv2.COLOR_BGR2GRAY)
+
+
+class ChannelHarvester(Harvester):
+    """
+    the low-order bits of every colour channel of every pixel of one frame
+    """
+    def __init__(self, bits=1):
+        """
+        :param bits: low-order bits kept per channel
+        """
+        self.bits = bits
+        self.name = "channel%d" % bits
+
+    def samples(self, frames: list):
+        return frames[0]
+
+
+class TemporalHarvester(Harvester):
+    """
+    the temporal noise of several consecutive full colour frames, the static scene cancels out and only the sensor
+    noise is left
+    """
+    def __init__(self, frames=2, bits=1, mode="xor"):
+        """
+        :param frames: number of consecutive frames combined into each block
+        :param bits: low-order bits kept per channel
+        :param mode: xor (xor of all the frames) or diff (differences of consecutive frames, xored together)
+        """
+        assert mode in ("xor", "diff") and frames >= 2
+        self.frames = frames
+        self.bits = bits
+        self.mode = mode
+        self.name = "%s%d-%d" % (mode, frames, bits)
+
+    def samples(self, frames: list):
+        if self.mode == "xor":
+            return np.bitwise_xor.reduce(np.stack(frames), axis=0)
+        # uint8 subtraction wraps around, so the low bits of the difference are exact
+        diffs = np.subtract(np.stack(frames[1:]), np.stack(frames[:-1]))
+        return np.bitwise_xor.reduce(diffs, axis=0)
+
+
+def get_harvester(name: str):
+    """
+    build a harvester by its name, used by command line tools
+    :param name: lsb, channel<bits>, xor<frames>-<bits> or diff<frames>-<bits>
+    :return: a new harvester
+    """
+    if name == "lsb":
+        return LsbHarvester()
+    if name.startswith("channel"):
+        return ChannelHarvester(int(name[7:]))
+    for mode in ("xor", "diff"):
+        if name.startswith(mode):
+            frames, bits = name[len(mode):].split("-")
+            return TemporalHarvester(int(frames), int(bits), mode)
+    raise ValueError("Unknown harvester %s" % name)
+
+
+def survey(source: FrameSource, harvesters: list, blocks=8):
+    """
+    compare harvesting modes on a frame source
+    :param source: an open frame source
+    :param harvesters: list of harvesters to compare
+    :param blocks: number of blocks harvested with each mode
+    :return: list of dicts with the name, raw bits per block, min-entropy per bit and good bits per second of each mode
+    """
+    results = []
+    for harvester in harvesters:
+        estimates = []
+        raw_bits = 0
+        elapsed = 0.0
+        for i in range(blocks):
+            # only capturing and harvesting are timed, the estimate isn't part of normal operation
+            start = time.perf_counter()
+            frames = []
+            for j in range(harvester.frames):
+                check, frame = source.read()
+                if not check:
+                    raise RuntimeError("Frame source stopped giving frames")
+                frames.append(frame)
+            raw_bits = len(harvester.harvest(frames)) * 8
+            elapsed += time.perf_counter() - start
+            estimates.append(harvester.estimate(frames))
+        entropy = min(estimates)
+        results.append({"name": harvester.name, "raw_bits": raw_bits, "min_entropy": entropy,
+                        "good_bits_per_sec": raw_bits * entropy * blocks / elapsed})
+        logging.info("Harvesting: %s gives %d bits per block at %f min-entropy per bit" %
+                     (harvester.name, raw_bits, entropy))
+    return results
+
+
+if __name__ == '__main__':
+    assert low_bits(np.array([1, 2, 3, 4, 5, 6, 7, 8], dtype=np.uint8), 1) == b"\xaa"
+    assert low_bits(np.array([1, 2, 3, 4], dtype=np.uint8), 2) == b"\x6c"
+    assert min_entropy(np.zeros(1000, dtype=np.uint8), 1) == 0.0
+    src = source_from_spec(sys.argv[1] if len(sys.argv) > 1 else "camera")
+    src.open()
+    for res in survey(src, [LsbHarvester(), ChannelHarvester(1), ChannelHarvester(2), TemporalHarvester(2, 1),
+                            TemporalHarvester(2, 2), TemporalHarvester(2, 1, "diff")]):
+        print("%(name)-10s %(raw_bits)10d bits/block  %(min_entropy).3f H/bit  %(good_bits_per_sec).0f good bits/s"
+              % res)
+    src.release()
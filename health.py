@@ -0,0 +1,135 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: Continuous health tests for the camera source (SP 800-90B style), run on every raw block before it is
+conditioned so a black, saturated or frozen camera is noticed instead of quietly producing weak keys
+"""
+import hashlib
+import logging
+import math
+import numpy as np
+
+
+class HealthTestError(RuntimeError):
+    """
+    raised when the raw camera output fails a health test
+    """
+    pass
+
+
+def apt_cutoff(window, prob, alpha_exp):
+    """
+    cutoff of the adaptive proportion test, the smallest count the first symbol of a window reaches with probability
+    at most 2^-alpha_exp
+    :param window: window size in symbols
+    :param prob: probability of the most likely symbol (2^-H)
+    :param alpha_exp: false positive probability exponent
+    :return: the cutoff count
+    """
+    alpha = 2.0 ** -alpha_exp
+    tail = 1.0
+    # the first symbol is always counted, the other window - 1 symbols are binomial
+    for count in range(window):
+        tail -= math.comb(window - 1, count) * prob ** count * (1 - prob) ** (window - 1 - count)
+        if tail <= alpha:
+            return count + 2
+    return window
+
+
+class HealthMonitor:
+    """
+    runs the repetition count, adaptive proportion and frame identity tests on raw blocks (bytes of packed LSBs),
+    keeping state between blocks so runs and windows crossing block borders are tested too
+    """
+    def __init__(self, min_entropy=2.0, alpha_exp=20, window=512, on_failure="raise", quarantine_limit=8):
+        """
+        :param min_entropy: claimed min-entropy per raw byte, in bits
+        :param alpha_exp: false positive probability of each test is 2^-alpha_exp
+        :param window: adaptive proportion test window size in bytes
+        :param on_failure: "raise" to raise HealthTestError on the first failure, "quarantine" to drop failed blocks
+        :param quarantine_limit: number of failed blocks in a row after which quarantine gives up and raises
+        """
+        assert on_failure in ("raise", "quarantine")
+        self.rct_cutoff = 1 + math.ceil(alpha_exp / min_entropy)
+        self.apt_cutoff = apt_cutoff(window, 2.0 ** -min_entropy, alpha_exp)
+        self.window = window
+        self.on_failure = on_failure
+        self.quarantine_limit = quarantine_limit
+        # repetition count test state, the symbol and length of the run at the end of the last block
+        self.run_symbol = -1
+        self.run_length = 0
+        # adaptive proportion test state, the unfinished window at the end of the last block
+        self.apt_carry = np.zeros(0, dtype=np.uint8)
+        self.last_digest = None
+        self.failed_in_row = 0
+        self.counters = {"blocks": 0, "bytes": 0, "rct_failures": 0, "apt_failures": 0, "repeat_failures": 0,
+                         "quarantined": 0}
+        logging.debug("Health: RCT cutoff %d, APT cutoff %d/%d" % (self.rct_cutoff, self.apt_cutoff, window))
+
+    def _repetition_count(self, data: np.ndarray):
+        """
+        repetition count test, fails on a run of identical bytes of rct_cutoff or longer
+        :return: passed t/f
+        """
+        starts = np.flatnonzero(data[1:] != data[:-1]) + 1
+        runs = np.diff(np.concatenate(([0], starts, [len(data)])))
+        # the first run continues the run from the previous block if it is of the same symbol
+        if data[0] == self.run_symbol:
+            runs[0] += self.run_length
+        self.run_symbol = int(data[-1])
+        self.run_length = int(runs[-1])
+        return int(runs.max()) < self.rct_cutoff
+
+    def _adaptive_proportion(self, data: np.ndarray):
+        """
+        adaptive proportion test, fails if the first byte of a window repeats apt_cutoff times or more in it
+        :return: passed t/f
+        """
+        data = np.concatenate((self.apt_carry, data))
+        full = len(data) // self.window * self.window
+        self.apt_carry = data[full:].copy()
+        windows = data[:full].reshape(-1, self.window)
+        counts = np.count_nonzero(windows == windows[:, :1], axis=1)
+        return not len(counts) or int(counts.max()) < self.apt_cutoff
+
+    def _frame_identity(self, block: bytes):
+        """
+        frame identity test, fails if a block is identical to the previous one (frozen or repeated frame)
+        :return: passed t/f
+        """
+        digest = hashlib.blake2b(block, digest_size=16).digest()
+        res = digest != self.last_digest
+        self.last_digest = digest
+        return res
+
+    def check(self, block: bytes):
+        """
+        run all the tests on a raw block
+        :param block: raw bytes of packed LSBs
+        :return: whether the block may be used, False only in quarantine mode
+        """
+        if not block:
+            return True
+        data = np.frombuffer(block, dtype=np.uint8)
+        self.counters["blocks"] += 1
+        self.counters["bytes"] += len(block)
+        failed = []
+        if not self._repetition_count(data):
+            self.counters["rct_failures"] += 1
+            failed.append("repetition count")
+        if not self._adaptive_proportion(data):
+            self.counters["apt_failures"] += 1
+            failed.append("adaptive proportion")
+        if not self._frame_identity(block):
+            self.counters["repeat_failures"] += 1
+            failed.append("frame identity")
+        if not failed:
+            self.failed_in_row = 0
+            return True
+        self.failed_in_row += 1
+        logging.error("Health: Raw block failed the %s test" % ", ".join(failed))
+        if self.on_failure == "raise" or self.failed_in_row >= self.quarantine_limit:
+            raise HealthTestError("Camera output failed the %s health test, the camera might be covered, frozen or"
+                                  " broken" % ", ".join(failed))
+        self.counters["quarantined"] += 1
+        return False
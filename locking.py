@@ -0,0 +1,74 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: A small cross-process file lock (fcntl on linux/mac, msvcrt on windows) for state shared between
+processes that don't share a parent, like the shared entropy ring
+"""
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """
+    exclusive lock on a lock file, usable as a context manager. Also holds a thread lock, since the file lock alone
+    doesn't exclude threads of the same process sharing the object
+    """
+    def __init__(self, path):
+        """
+        :param path: path of the lock file, created if missing
+        """
+        self.path = path
+        self.thread_lock = threading.Lock()
+        self.fd = None
+        self.pid = None
+
+    def __del__(self):
+        self.close()
+
+    def acquire(self):
+        """
+        block until the lock is held
+        """
+        self.thread_lock.acquire()
+        # the lock file stays open between acquires, so taking an uncontended lock costs a single system call. A
+        # forked child shares the parent's open file, and with it the parent's lock, so it opens its own
+        if self.fd is None or self.pid != os.getpid():
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            self.pid = os.getpid()
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        else:
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            msvcrt.locking(self.fd, msvcrt.LK_LOCK, 1)
+
+    def release(self):
+        """
+        release the lock
+        """
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+        self.thread_lock.release()
+
+    def close(self):
+        """
+        close the lock file, the lock must not be held
+        """
+        if self.fd is not None and self.pid == os.getpid():
+            os.close(self.fd)
+        self.fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
@@ -0,0 +1,308 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: Vectorized streaming implementation of the core NIST SP 800-22 statistical tests (frequency, block
+frequency, runs, longest run, cumulative sums, approximate entropy and serial), to check what Random produces over
+millions of bits in bounded memory
+"""
+import argparse
+import logging
+import math
+import numpy as np
+from chaotic_source import Random
+from conditioning import get_conditioner
+from frame_source import source_from_spec
+from harvesting import get_harvester
+
+ALPHA = 0.01
+# bits processed at once, bounds the memory used no matter how large the input chunks are
+STEP = 1 << 22
+# longest run of ones test: block size -> (class limits, class probabilities)
+LONGEST_RUN = {8: ((1, 2, 3, 4), (0.2148, 0.3672, 0.2305, 0.1875)),
+               128: ((4, 5, 6, 7, 8, 9), (0.1174, 0.2430, 0.2493, 0.1752, 0.1027, 0.1124)),
+               10000: ((10, 11, 12, 13, 14, 15, 16), (0.0882, 0.2092, 0.2483, 0.1933, 0.1208, 0.0675, 0.0727))}
+
+
+def igamc(a, x):
+    """
+    regularized upper incomplete gamma function Q(a, x), series expansion below a + 1 and continued fraction above
+    """
+    if x <= 0:
+        return 1.0
+    log_front = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:
+        term = total = 1.0 / a
+        n = a
+        while abs(term) > abs(total) * 1e-15:
+            n += 1
+            term *= x / n
+            total += term
+        return max(0.0, 1.0 - total * math.exp(log_front))
+    # modified Lentz's method
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    i = 0
+    while True:
+        i += 1
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return math.exp(log_front) * h
+
+
+def normal_cdf(x):
+    """
+    standard normal cumulative distribution function
+    """
+    return 0.5 * math.erfc(-x / math.sqrt(2))
+
+
+def trunc_div(a, b):
+    """
+    integer division rounding toward zero (like C), used to match the reference cumulative sums bounds
+    """
+    return int(a / b)
+
+
+def patterns(bits: np.ndarray, width: int, start: int):
+    """
+    count the overlapping width-bit patterns starting at every position from start on
+    :param bits: uint8 array of bits
+    :param width: pattern width
+    :param start: first start position
+    :return: count of each pattern value, of length 2^width
+    """
+    count = len(bits) - width + 1 - start
+    if count <= 0 or width == 0:
+        return np.zeros(1 << width, dtype=np.int64)
+    vals = np.zeros(count, dtype=np.int64)
+    for k in range(width):
+        vals = (vals << 1) | bits[start + k:start + k + count]
+    return np.bincount(vals, minlength=1 << width)
+
+
+class Battery:
+    """
+    streaming SP 800-22 test battery, fed with chunks of packed bits through update. Every test keeps a small state
+    (counters and the few bits crossing chunk borders), so the input can be as large as needed
+    """
+    def __init__(self, block_m=128, longest_m=10000, apen_m=10, serial_m=16):
+        """
+        :param block_m: block frequency test block size
+        :param longest_m: longest run of ones test block size (8, 128 or 10000)
+        :param apen_m: approximate entropy test pattern width
+        :param serial_m: serial test pattern width
+        """
+        assert longest_m in LONGEST_RUN
+        self.block_m = block_m
+        self.longest_m = longest_m
+        self.apen_m = apen_m
+        self.serial_m = serial_m
+        self.widths = sorted({apen_m, apen_m + 1, serial_m, serial_m - 1, serial_m - 2} - {0})
+        self.span = max(self.widths) - 1
+        self.n = 0
+        self.ones = 0
+        self.transitions = 0
+        self.last = None
+        self.cusum = 0
+        self.cusum_max = 0
+        self.cusum_min = 0
+        self.block_chi = 0.0
+        self.block_count = 0
+        self.block_carry = np.zeros(0, dtype=np.uint8)
+        self.longest_classes = np.zeros(len(LONGEST_RUN[longest_m][0]), dtype=np.int64)
+        self.longest_carry = np.zeros(0, dtype=np.uint8)
+        self.counts = {w: np.zeros(1 << w, dtype=np.int64) for w in self.widths}
+        self.head = np.zeros(0, dtype=np.uint8)
+        self.tail = np.zeros(0, dtype=np.uint8)
+
+    def update(self, data: bytes):
+        """
+        feed the next chunk of the stream
+        :param data: packed bits
+        """
+        bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+        for i in range(0, len(bits), STEP):
+            self._update_bits(bits[i:i + STEP])
+
+    def _update_bits(self, bits: np.ndarray):
+        """
+        update every test's state with an array of bits
+        """
+        if not len(bits):
+            return
+        self.n += len(bits)
+        self.ones += int(bits.sum())
+        # runs: transitions inside the chunk and across the border with the previous one
+        self.transitions += int(np.count_nonzero(bits[1:] != bits[:-1]))
+        if self.last is not None and bits[0] != self.last:
+            self.transitions += 1
+        self.last = bits[-1]
+        # cumulative sums: running extremes of the +-1 walk
+        walk = np.cumsum(bits.astype(np.int64) * 2 - 1) + self.cusum
+        self.cusum = int(walk[-1])
+        self.cusum_max = max(self.cusum_max, int(walk.max()))
+        self.cusum_min = min(self.cusum_min, int(walk.min()))
+        self._update_blocks(bits)
+        self._update_longest(bits)
+        # pattern counts, counting each pattern in the chunk its last bit is in
+        joined = np.concatenate((self.tail, bits))
+        for w in self.widths:
+            self.counts[w] += patterns(joined, w, max(0, len(self.tail) - w + 1))
+        if len(self.head) < self.span:
+            self.head = np.concatenate((self.head, bits[:self.span - len(self.head)]))
+        self.tail = joined[max(0, len(joined) - self.span):].copy()
+
+    def _update_blocks(self, bits: np.ndarray):
+        """
+        block frequency state update
+        """
+        bits = np.concatenate((self.block_carry, bits))
+        full = len(bits) // self.block_m * self.block_m
+        self.block_carry = bits[full:].copy()
+        if full:
+            props = bits[:full].reshape(-1, self.block_m).mean(axis=1)
+            self.block_chi += float(((props - 0.5) ** 2).sum())
+            self.block_count += len(props)
+
+    def _update_longest(self, bits: np.ndarray):
+        """
+        longest run of ones state update
+        """
+        m = self.longest_m
+        bits = np.concatenate((self.longest_carry, bits))
+        full = len(bits) // m * m
+        self.longest_carry = bits[full:].copy()
+        if not full:
+            return
+        # pad each block with zeros on both sides, the runs of ones are the gaps between consecutive zeros
+        padded = np.zeros((full // m, m + 2), dtype=np.uint8)
+        padded[:, 1:-1] = bits[:full].reshape(-1, m)
+        zeros = np.flatnonzero(padded.ravel() == 0)
+        runs = np.diff(zeros) - 1
+        rows = zeros[:-1] // (m + 2)
+        longest = np.maximum.reduceat(runs, np.searchsorted(rows, np.arange(len(padded))))
+        limits = LONGEST_RUN[m][0]
+        classes = np.clip(np.searchsorted(limits, longest), 0, len(limits) - 1)
+        self.longest_classes += np.bincount(classes, minlength=len(limits))
+
+    def _psi(self, counts: dict, m: int):
+        """
+        psi squared statistic of the serial test
+        """
+        if m <= 0:
+            return 0.0
+        return float((counts[m].astype(np.float64) ** 2).sum()) * (1 << m) / self.n - self.n
+
+    def results(self):
+        """
+        compute the p-values of every test on the stream so far
+        :return: dict test name -> p-value
+        """
+        n = self.n
+        assert n > self.span, "not enough bits"
+        res = {}
+        s_obs = abs(2 * self.ones - n) / math.sqrt(n)
+        res["frequency"] = math.erfc(s_obs / math.sqrt(2))
+        if self.block_count:
+            res["block_frequency"] = igamc(self.block_count / 2, 4 * self.block_m * self.block_chi / 2)
+        pi = self.ones / n
+        if abs(pi - 0.5) >= 2 / math.sqrt(n):
+            res["runs"] = 0.0
+        else:
+            v_obs = self.transitions + 1
+            res["runs"] = math.erfc(abs(v_obs - 2 * n * pi * (1 - pi)) / (2 * math.sqrt(2 * n) * pi * (1 - pi)))
+        blocks = int(self.longest_classes.sum())
+        if blocks:
+            probs = np.array(LONGEST_RUN[self.longest_m][1])
+            chi = float((((self.longest_classes - blocks * probs) ** 2) / (blocks * probs)).sum())
+            res["longest_run"] = igamc((len(probs) - 1) / 2, chi / 2)
+        forward = max(abs(self.cusum_max), abs(self.cusum_min))
+        backward = max(abs(self.cusum - self.cusum_min), abs(self.cusum - self.cusum_max))
+        res["cusum_forward"] = self._cusum_p(forward)
+        res["cusum_backward"] = self._cusum_p(backward)
+        # wrap around: the patterns running from the end of the stream back into its beginning
+        counts = {}
+        for w in self.widths:
+            wrap = np.concatenate((self.tail[len(self.tail) - w + 1:], self.head[:w - 1]))
+            counts[w] = self.counts[w] + patterns(wrap, w, 0)
+        phi = []
+        for w in (self.apen_m, self.apen_m + 1):
+            c = counts[w][counts[w] > 0] / n
+            phi.append(float((c * np.log(c)).sum()))
+        apen = phi[0] - phi[1]
+        res["approximate_entropy"] = igamc(2 ** (self.apen_m - 1), n * (math.log(2) - apen))
+        m = self.serial_m
+        psi = [self._psi(counts, m), self._psi(counts, m - 1), self._psi(counts, m - 2)]
+        res["serial_1"] = igamc(2 ** (m - 2), (psi[0] - psi[1]) / 2)
+        res["serial_2"] = igamc(2 ** (m - 3), (psi[0] - 2 * psi[1] + psi[2]) / 2)
+        return res
+
+    def _cusum_p(self, z):
+        """
+        p-value of the cumulative sums test for a maximal excursion z
+        """
+        n = self.n
+        if z == 0:
+            return 0.0
+        root = math.sqrt(n)
+        total = 1.0
+        for k in range(trunc_div(trunc_div(-n, z) + 1, 4), trunc_div(trunc_div(n, z) - 1, 4) + 1):
+            total -= normal_cdf((4 * k + 1) * z / root) - normal_cdf((4 * k - 1) * z / root)
+        for k in range(trunc_div(trunc_div(-n, z) - 3, 4), trunc_div(trunc_div(n, z) - 1, 4) + 1):
+            total += normal_cdf((4 * k + 3) * z / root) - normal_cdf((4 * k + 1) * z / root)
+        return total
+
+
+def run_battery(rand: Random, n_bits: int, chunk=1 << 20, battery: Battery = None):
+    """
+    stream n_bits of a Random object's output through the battery
+    :param rand: RNG object, in any mode
+    :param n_bits: number of bits to test
+    :param chunk: bytes requested at a time
+    :param battery: battery to use, the default settings if not given
+    :return: dict test name -> p-value
+    """
+    battery = Battery() if battery is None else battery
+    left = n_bits // 8
+    while left:
+        size = min(chunk, left)
+        battery.update(rand.get_random_bytes(size))
+        left -= size
+    logging.info("NIST: Tested %d bits" % battery.n)
+    return battery.results()
+
+
+def main():
+    """
+    test the output of a Random configuration from the command line
+    """
+    parser = argparse.ArgumentParser(description="NIST SP 800-22 test battery for CameRAND output")
+    parser.add_argument("--source", default="camera", help="frame source spec, e.g. camera:0 or replay:x.npy")
+    parser.add_argument("--mode", default="entropy", choices=("entropy", "drbg"))
+    parser.add_argument("--conditioner", default="none")
+    parser.add_argument("--harvester", default="lsb")
+    parser.add_argument("--bits", type=int, default=1 << 24, help="number of bits to test")
+    args = parser.parse_args()
+    rand = Random(source_from_spec(args.source), mode=args.mode, conditioner=get_conditioner(args.conditioner),
+                  harvester=get_harvester(args.harvester))
+    res = run_battery(rand, args.bits)
+    rand.pause()
+    for name, p in res.items():
+        print("%-20s %.6f %s" % (name, p, "PASS" if p >= ALPHA else "FAIL"))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -0,0 +1,136 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: Parallel prime search over a process pool. The parent draws every search's random base and witness seed
+from its Random object, the workers sieve and test from there, and once enough primes are found the remaining
+searches are cancelled
+"""
+import logging
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+from drbg import Drbg, SEED_SIZE
+from RSA import DEFAULT_KEY_SIZE, KEY_PROFILES, fits_profile, prime_base, search_prime
+
+# how often a cancel event given by the caller is checked while waiting for the workers
+POLL = 0.1
+
+# the engine's cancel event, handed to every worker process when it starts
+_cancel = None
+
+
+def _init_worker(cancel):
+    """
+    worker process initializer
+    :param cancel: the engine's cancel event, set once the parent has enough primes
+    """
+    global _cancel
+    _cancel = cancel
+
+
+def _search(base, seed, rounds):
+    """
+    worker side of a search
+    :param base: odd base to search from
+    :param seed: witness DRBG seed, None for baillie-psw
+    :param rounds: number of rabin-miller rounds
+    :return: (prime or None if cancelled, stats dict)
+    """
+    stats = {}
+    prime = search_prime(base, Drbg(seed=seed) if seed is not None else None, stats, _cancel, rounds)
+    return prime, stats
+
+
+class PrimeEngine:
+    """
+    a pool of prime search worker processes. Workers are spawned rather than forked, since the parent usually runs the
+    camera capture thread (and maybe a GUI)
+    """
+    def __init__(self, workers=None, test="rabin_miller"):
+        """
+        :param workers: number of worker processes, the number of cores by default
+        :param test: "rabin_miller" or "bpsw", see RSA.get_prime
+        """
+        assert test in ("rabin_miller", "bpsw")
+        self.workers = workers or os.cpu_count() or 1
+        self.test = test
+        context = get_context("spawn")
+        # a plain event in shared memory, so the workers can check it on every candidate without a round trip
+        self.cancel = context.Event()
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker,
+                                            initargs=(self.cancel,))
+        # the workers share one cancel event, so only one get_primes call runs at a time
+        self.lock = threading.Lock()
+        self.stats = {}
+        logging.info("PrimeEngine: Started %d workers" % self.workers)
+
+    def _submit(self, rand, key_size):
+        """
+        start a search from a fresh random base
+        """
+        bits, rounds = KEY_PROFILES[key_size]
+        base = prime_base(rand, bits)
+        seed = rand.get_random_bytes(SEED_SIZE) if self.test == "rabin_miller" else None
+        return self.executor.submit(_search, base, seed, rounds)
+
+    def get_primes(self, rand, count, cancel: threading.Event = None, key_size=DEFAULT_KEY_SIZE):
+        """
+        find primes in parallel, one per search, with a search running on every worker until count primes are found
+        :param rand: RNG object the bases and witness seeds are drawn from
+        :param count: number of primes needed
+        :param cancel: optional event, when set the search stops early
+        :param key_size: RSA key size the primes are for, one of RSA.KEY_PROFILES
+        :return: list of the primes found, shorter than count only if cancelled
+        """
+        logging.debug("PrimeEngine: %d primes for %d bit keys requested" % (count, key_size))
+        primes = []
+        with self.lock:
+            # every worker searches even when fewer primes are needed, whichever finishes first wins
+            running = {self._submit(rand, key_size) for i in range(self.workers)} if count > 0 else set()
+            try:
+                while running:
+                    done, running = wait(running, POLL if cancel is not None else None, FIRST_COMPLETED)
+                    for future in done:
+                        prime, stats = future.result()
+                        for key, value in stats.items():
+                            self.stats[key] = self.stats.get(key, 0) + value
+                        # a search that ran past the top of the range doesn't count
+                        if prime is not None and fits_profile(prime, key_size) and len(primes) < count:
+                            primes.append(prime)
+                    if len(primes) >= count or (cancel is not None and cancel.is_set()):
+                        # the other searches notice the event on their next candidate and return nothing
+                        self.cancel.set()
+                    elif not self.cancel.is_set():
+                        running |= {self._submit(rand, key_size) for i in range(self.workers - len(running))}
+            finally:
+                # stop whatever is still running (only left over if something failed) and wait for it, so the next
+                # call starts with the event clear
+                if running:
+                    self.cancel.set()
+                    wait(running)
+                self.cancel.clear()
+        logging.debug("PrimeEngine: Found %d primes" % len(primes))
+        return primes
+
+    def close(self):
+        """
+        stop the worker processes
+        """
+        self.executor.shutdown()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """
+    get the process-wide prime engine, creating it on first use so workers are only spawned once
+    :return: the prime engine
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = PrimeEngine()
+        return _engine
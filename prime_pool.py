@@ -0,0 +1,182 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: Prime pool daemon, keeps a prime store between a low and a high watermark with a pool of worker processes
+so key generation takes its primes from the store instead of searching for them. Runs headless from the command line
+or inside the GUI's collector page
+"""
+import argparse
+import logging
+import threading
+import time
+from collections import deque
+from entropy_service import get_random
+from prime_engine import PrimeEngine
+from prime_store import PrimeStore
+from RSA import DEFAULT_KEY_SIZE, KEY_PROFILES
+
+LOW_WATER = 16
+HIGH_WATER = 64
+# how often a full pool checks if it dropped below the low watermark
+POLL = 1.0
+# the production rate is measured over this many seconds
+RATE_WINDOW = 60.0
+
+
+class PrimePool:
+    """
+    refills a prime store in the background once it drops below the low watermark, until it reaches the high one
+    """
+    def __init__(self, key_size=DEFAULT_KEY_SIZE, low=LOW_WATER, high=HIGH_WATER, workers=None, rand=None,
+                 engine: PrimeEngine = None):
+        """
+        :param key_size: RSA key size the pool's primes are for, one of RSA.KEY_PROFILES
+        :param low: start filling when the store holds fewer primes than this
+        :param high: stop filling once the store holds this many primes
+        :param workers: number of worker processes, the number of cores by default
+        :param rand: RNG object the searches are seeded from, get_random() by default
+        :param engine: prime engine to search with, like the process-wide one from prime_engine.get_engine(). It is
+        left running when the pool stops. By default the pool starts its own with workers processes
+        """
+        assert 0 <= low <= high
+        self.key_size = key_size
+        self.low = low
+        self.high = high
+        self.workers = workers
+        self.rand = rand
+        self.store = PrimeStore(key_size)
+        self.engine = engine
+        self.own_engine = engine is None
+        self.filling = False
+        self.produced = 0
+        self.recent = deque()
+        self.started = 0.0
+        self.error = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _run(self):
+        """
+        pool thread loop, stops the pool's filling (and records why) if anything in it fails
+        """
+        rand = self.rand
+        try:
+            if rand is None:
+                rand = get_random()
+            # the camera is only held while filling
+            rand.pause()
+            while not self.stopped.is_set():
+                level = self.store.available()
+                if level >= self.high:
+                    if self.filling:
+                        logging.info("PrimePool: Full with %d primes, pausing" % level)
+                        rand.pause()
+                    self.filling = False
+                elif level < self.low and not self.filling:
+                    logging.info("PrimePool: Down to %d primes, filling" % level)
+                    rand.cont()
+                    self.filling = True
+                if not self.filling:
+                    self.stopped.wait(POLL)
+                    continue
+                primes = self.engine.get_primes(rand, min(self.engine.workers, self.high - level), self.stopped,
+                                                self.key_size)
+                self.store.append(primes)
+                self.produced += len(primes)
+                now = time.monotonic()
+                self.recent.extend([now] * len(primes))
+        except Exception as err:
+            logging.exception("PrimePool: Filling failed")
+            self.error = "%s: %s" % (type(err).__name__, err)
+        finally:
+            self.filling = False
+            if rand is not None:
+                rand.pause()
+
+    def start(self):
+        """
+        start the worker processes and the pool thread
+        """
+        if self.engine is None:
+            self.engine = PrimeEngine(self.workers)
+        self.error = None
+        self.stopped.clear()
+        self.started = time.monotonic()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        logging.info("PrimePool: Started for %d bit keys, watermarks %d-%d" % (self.key_size, self.low, self.high))
+
+    def stop(self):
+        """
+        stop the pool, cancelling the searches in progress, and the worker processes if the pool started them
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.own_engine and self.engine is not None:
+            self.engine.close()
+            self.engine = None
+        self.filling = False
+        logging.info("PrimePool: Stopped after producing %d primes" % self.produced)
+
+    def fill_level(self):
+        """
+        :return: number of primes in the store
+        """
+        return self.store.available()
+
+    def rate(self):
+        """
+        :return: primes produced per second over the last RATE_WINDOW seconds
+        """
+        now = time.monotonic()
+        while self.recent and self.recent[0] < now - RATE_WINDOW:
+            self.recent.popleft()
+        elapsed = min(RATE_WINDOW, now - self.started)
+        return len(self.recent) / elapsed if elapsed > 0 else 0.0
+
+    def status(self):
+        """
+        :return: dict of the pool's state, for reports and the GUI. state is "filling", "full" (at the high watermark)
+        or "idle" (between the watermarks, waiting to drop below the low one), error is the reason the pool stopped
+        filling on its own, None while it works
+        """
+        level = self.fill_level()
+        state = "filling" if self.filling else "full" if level >= self.high else "idle"
+        return {"key_size": self.key_size, "level": level, "low": self.low, "high": self.high, "filling": self.filling,
+                "state": state, "produced": self.produced, "rate": self.rate(), "error": self.error}
+
+
+def main():
+    """
+    run a prime pool from the command line until interrupted, printing its status
+    """
+    parser = argparse.ArgumentParser(description="CameRAND prime pool daemon")
+    parser.add_argument("--key-size", type=int, default=DEFAULT_KEY_SIZE, choices=sorted(KEY_PROFILES))
+    parser.add_argument("--low", type=int, default=LOW_WATER, help="start filling below this many primes")
+    parser.add_argument("--high", type=int, default=HIGH_WATER, help="stop filling at this many primes")
+    parser.add_argument("--workers", type=int, help="worker processes, the number of cores by default")
+    parser.add_argument("--report", type=float, default=10.0, help="seconds between status lines")
+    args = parser.parse_args()
+    pool = PrimePool(args.key_size, args.low, args.high, args.workers)
+    pool.start()
+    try:
+        while True:
+            time.sleep(args.report)
+            status = pool.status()
+            if status["error"] is not None:
+                print("Prime pool failed: %s" % status["error"], flush=True)
+                break
+            print("%d/%d primes, %s, %.1f primes/min, %d produced" % (
+                status["level"], status["high"], status["state"], status["rate"] * 60,
+                status["produced"]), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename="prime_pool.log", level=logging.INFO)
+    main()
@@ -0,0 +1,163 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: Append-only binary store for collected primes. Primes are fixed width big-endian records after a small
+header holding the consume cursor, appended and taken under a file lock so collector threads, keygen and other
+processes can share one store
+"""
+import logging
+import mmap
+import os
+import pickle
+import struct
+from locking import FileLock
+from RSA import DEFAULT_KEY_SIZE, KEY_PROFILES, PUBLIC_EXPONENT, fits_profile
+
+STORE_PATH = "primes.bin"
+MAGIC = b"CMRPRIME"
+VERSION = 1
+# magic, version, record size, consume cursor (index of the next record to take), padded to HEADER bytes
+HEADER_FORMAT = "<8sIIQ"
+HEADER = 64
+# every pickle older versions wrote starts with the protocol opcode
+PICKLE_PROTO = b"\x80"
+
+
+def store_path(key_size=DEFAULT_KEY_SIZE):
+    """
+    :param key_size: RSA key size the primes are for
+    :return: path of the store for that key size, primes.bin for the default one
+    """
+    if key_size == DEFAULT_KEY_SIZE:
+        return STORE_PATH
+    return "primes_%d.bin" % key_size
+
+
+class PrimeStore:
+    """
+    a prime store file for one key size profile. Appends only write the new records and takes only move the cursor
+    (and wipe the records taken), so both are O(1) no matter how many primes the store holds
+    """
+    def __init__(self, key_size=DEFAULT_KEY_SIZE, path=None):
+        """
+        :param key_size: RSA key size the stored primes are for, one of RSA.KEY_PROFILES
+        :param path: path of the store file, store_path(key_size) by default
+        """
+        self.key_size = key_size
+        self.record = KEY_PROFILES[key_size][0] // 8
+        self.path = store_path(key_size) if path is None else path
+        self.lock = FileLock(self.path + ".lock")
+
+    def _header(self, cursor):
+        """
+        :param cursor: consume cursor
+        :return: header bytes
+        """
+        return struct.pack(HEADER_FORMAT, MAGIC, VERSION, self.record, cursor).ljust(HEADER, b"\0")
+
+    def _open(self):
+        """
+        open the store for reading and writing, creating it (or converting a pickled prime list) if needed. Called
+        with the lock held
+        :return: file object
+        """
+        if os.path.exists(self.path):
+            file = open(self.path, "r+b")
+            head = file.read(HEADER)
+            if head[:len(MAGIC)] == MAGIC:
+                magic, version, record, cursor = struct.unpack_from(HEADER_FORMAT, head)
+                assert record == self.record, "%s holds %d byte primes" % (self.path, record)
+                return file
+            file.close()
+            if head[:len(PICKLE_PROTO)] != PICKLE_PROTO:
+                raise ValueError("%s is neither a prime store nor a pickled prime list" % self.path)
+            self._migrate()
+        else:
+            self._write([])
+        return open(self.path, "r+b")
+
+    def _write(self, primes):
+        """
+        replace the store with a new one holding primes, through a temporary file so it is never half written
+        """
+        temp = self.path + ".tmp"
+        with open(temp, "wb") as file:
+            file.write(self._header(0) + b"".join(num.to_bytes(self.record, "big") for num in primes))
+        os.replace(temp, self.path)
+
+    def _migrate(self):
+        """
+        convert the pickled list of primes older versions kept in primes.bin
+        """
+        with open(self.path, "rb") as file:
+            try:
+                primes = pickle.load(file)
+            except Exception as err:
+                raise ValueError("%s is not a readable pickled prime list: %s" % (self.path, err))
+        if not isinstance(primes, list):
+            raise ValueError("%s holds a pickled %s, not a prime list" % (self.path, type(primes).__name__))
+        # primes search_prime would have skipped can't be paired with the public exponent
+        kept = [num for num in primes if isinstance(num, int) and fits_profile(num, self.key_size)
+                and num % PUBLIC_EXPONENT != 1]
+        self._write(kept)
+        logging.info("PrimeStore: Converted %s, kept %d of %d primes" % (self.path, len(kept), len(primes)))
+
+    def _count(self, file):
+        """
+        :return: (consume cursor, number of records ever appended)
+        """
+        file.seek(0)
+        cursor = struct.unpack_from(HEADER_FORMAT, file.read(HEADER))[3]
+        return cursor, (os.fstat(file.fileno()).st_size - HEADER) // self.record
+
+    def append(self, primes):
+        """
+        add primes to the end of the store
+        :param primes: list of primes of the store's size
+        """
+        data = b"".join(num.to_bytes(self.record, "big") for num in primes)
+        with self.lock:
+            with self._open() as file:
+                cursor, count = self._count(file)
+                # write over a partial record a crashed append may have left, so records stay aligned
+                file.seek(HEADER + count * self.record)
+                file.write(data)
+                file.truncate()
+        logging.debug("PrimeStore: Added %d primes to %s" % (len(primes), self.path))
+
+    def take(self, n):
+        """
+        take up to n primes out of the store, no prime is ever handed out twice
+        :param n: number of primes wanted
+        :return: list of at most n primes, oldest first
+        """
+        with self.lock:
+            with self._open() as file:
+                cursor, count = self._count(file)
+                n = min(n, count - cursor)
+                if n <= 0:
+                    return []
+                start = HEADER + cursor * self.record
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                    data = view[start:start + n * self.record]
+                if cursor + n == count:
+                    # everything was taken, start the file over instead of letting it grow forever
+                    file.truncate(HEADER)
+                    cursor = -n
+                else:
+                    # wipe the taken primes, they are about to become private keys
+                    file.seek(start)
+                    file.write(bytes(n * self.record))
+                file.seek(0)
+                file.write(self._header(cursor + n))
+        logging.debug("PrimeStore: Took %d primes from %s" % (n, self.path))
+        return [int.from_bytes(data[i:i + self.record], "big") for i in range(0, len(data), self.record)]
+
+    def available(self):
+        """
+        :return: number of primes left in the store
+        """
+        with self.lock:
+            with self._open() as file:
+                cursor, count = self._count(file)
+        return count - cursor
@@ -5,155 +5,185 @@ description: Server for CameRAND secure chat, for now requires a directory named
 current working directory
 """
 
+import asyncio
 import socket
-import select
 from Crypto.PublicKey import RSA
 from AES_new import AesNew
+from RSA import CrtKey
+from framing import accept_version, encode, get_decoder
 import logging
 
 # --------------------------- CONSTANTS ---------------------------
 SERVER_IP = '0.0.0.0'
 SERVER_PORT = 20003
-LISTEN_SIZE = 5
+LISTEN_SIZE = 128
 READ_SIZE = 3
 TIMEOUT = 60
+KEY_PATH = "server_keys/id_rsa"
 socket.setdefaulttimeout(TIMEOUT)
 
 # --------------------------- MAIN ---------------------------
 
 
-def main():
+def main(key_path=KEY_PATH, addr=(SERVER_IP, SERVER_PORT)):
     """
-    main loop, checks for new connections, errors, disconnects and messages (in this order), also makes secure
-    connections using an SSH key pair and an AES encryption. appends clients names to messages.
+    run the chat server until interrupted. Every connection gets its own protocol object driven by asyncio, so idle
+    clients cost nothing and there is no limit on their number but the OS's
+    :param key_path: path of the server's private key
+    :param addr: address to listen on (ip, port)
     """
     logging.debug("starting server")
-    open_client_sockets = []
-    client_addrs = {}
-    client_keys = {}
-    server_socket = socket.socket()
-    with open("server_keys/id_rsa", 'r') as file:
-        private = RSA.importKey(file.read())
-    # log-in phase:
+    with open(key_path, 'r') as file:
+        private = CrtKey.from_key(RSA.importKey(file.read()))
     try:
-        server_socket.bind((SERVER_IP, SERVER_PORT))
-        server_socket.listen(LISTEN_SIZE)
-        logging.debug("server started, listening for connections or messages")
-        while True:
-            rlist, wlist, xlist = select.select([server_socket] + open_client_sockets,
-                                                [], open_client_sockets, 0.01)
-            # check for exception
-            for current_socket in xlist:
-                logging.error("found error, disconnecting socket")
-                open_client_sockets.remove(current_socket)
-                current_socket.close()
-            for current_socket in rlist:
-                # check for new connection
-                if current_socket is server_socket:
-                    client_socket, client_address = current_socket.accept()
-                    open_client_sockets.append(client_socket)
-                    logging.info("new client added")
-                    break
-                else:
-                    # receive data
-                    data = protocol_read(current_socket)
-                    logging.debug("new data received: %s" % str(data))
-                    if data == 0 or data == "" or data == b'':
-                        if data == "" or data == b'':
-                            logging.exception("connection with client aborted, closing")
-                        open_client_sockets.remove(current_socket)
-                        if current_socket in client_addrs.keys():
-                            name = client_addrs[current_socket]
-                            logging.info("client %s disconnected" % name)
-                            client_addrs.pop(current_socket)
-                            if open_client_sockets:
-                                data = name + " has left the chat."
-                                send_available(open_client_sockets)
-                                for i in open_client_sockets:
-                                    enc_msg = client_keys[i].encrypt(data.encode())
-                                    i.send(protocol_encode(enc_msg, "bin"))
-                        if current_socket in client_keys.keys():
-                            client_keys.pop(current_socket)
-                        current_socket.close()
-
-                    elif data == 1:
-                        logging.debug("unnamed client requested starting secure connection")
-                        current_socket.send(protocol_encode(str(private.e)))
-                        current_socket.send(protocol_encode(str(private.n)))
-                        en_key = int(protocol_read(current_socket))
-                        key = pow(en_key, private.d, private.n)
-                        nonce = protocol_read(current_socket)
-                        cipher = AesNew(int_to_bytes(key), nonce)
-                        client_keys.update({current_socket: cipher})
-                        name_enc = protocol_read(current_socket)
-                        name = cipher.decrypt(name_enc).decode()
-                        client_addrs.update({current_socket: name})
-                        others = []
-                        others.extend(open_client_sockets)
-                        others.remove(current_socket)
-                        if others:
-                            data = name + " has entered the chat."
-                            send_available(others)
-                            for i in others:
-                                enc_msg = client_keys[i].encrypt(data.encode())
-                                i.send(protocol_encode(enc_msg, "bin"))
-                        logging.info("secure connection established with %s" % name)
-                    else:
-                        # make sure client is registered with the addresses dict
-                        if current_socket in client_keys.keys():
-                            msg = client_keys[current_socket].decrypt(data).decode()
-                            logging.debug("received message %s from client %s" % (msg, client_addrs[current_socket]))
-                            data = client_addrs[current_socket] + ": " + msg
-                            send_available(open_client_sockets)
-                            for i in open_client_sockets:
-                                enc_msg = client_keys[i].encrypt(data.encode())
-                                i.send(protocol_encode(enc_msg, "bin"))
-                            logging.debug("sent message to all clients successfully")
-                        else:
-                            pass
-    except socket.error as err:
+        asyncio.run(serve(ChatServer(private), addr))
+    except OSError as err:
         logging.error("encountered error with the connection, aborting server")
-        abort(open_client_sockets)
         print("error: " + str(err))
-    finally:
-        server_socket.close()
-
-# --------------------------- NETWORK FUNCS ---------------------------
 
 
-def protocol_encode(line, pre=""):
+async def serve(chat, addr):
     """
-    Encodes message according to the protocol (length prefix and type prefix)
-    :param line: line to encode
-    :param pre: prefix to add to the message for special messages like key and name
-    :return: protocol encoded message
+    accept connections forever
+    :param chat: the ChatServer the connections join
+    :param addr: address to listen on (ip, port)
     """
-    if pre == 'bin':
-        return (pre + str(len(line)).zfill(3)).encode() + line
-    return (pre + str(len(line)).zfill(3) + line).encode()  # add a 3-digit length prefix for protocol_read()
+    loop = asyncio.get_running_loop()
+    server = await loop.create_server(lambda: ChatProtocol(chat), addr[0], addr[1], backlog=LISTEN_SIZE)
+    logging.debug("server started, listening for connections or messages")
+    async with server:
+        await server.serve_forever()
 
 
-def protocol_read(socket):
+class ChatServer:
+    """
+    state shared by all connections: the server's key and the clients that finished the handshake
     """
-    read the message (exact length) using the protocol
-    :param socket: socket to read from
-    :return: message read from socket, parsed
+    def __init__(self, private: CrtKey):
+        """
+        :param private: the server's private key
+        """
+        self.private = private
+        self.clients = {}
+
+    def join(self, client, name):
+        """
+        add a client that finished the handshake and tell everyone else
+        :param client: the client's ChatProtocol
+        :param name: the client's display name
+        """
+        others = list(self.clients)
+        self.clients[client] = name
+        self.broadcast(name + " has entered the chat.", others)
+        logging.info("secure connection established with %s" % name)
+
+    def leave(self, client):
+        """
+        remove a client and tell everyone else
+        :param client: the client's ChatProtocol
+        """
+        name = self.clients.pop(client, None)
+        if name is not None:
+            logging.info("client %s disconnected" % name)
+            self.broadcast(name + " has left the chat.")
+
+    def broadcast(self, text, clients=None):
+        """
+        send a message to clients, each encrypted with its own key
+        :param text: message text
+        :param clients: list of clients to send to, every client that finished the handshake by default
+        """
+        for client in list(self.clients) if clients is None else clients:
+            client.send("bin", client.cipher.encrypt(text.encode()))
+
+
+class ChatProtocol(asyncio.Protocol):
     """
-    len = socket.recv(3).decode()  # get length
-    if len == "" or len == b'':  # check for error
-        return len
-    elif len == '%in':  # name message prefix
-        return 'n'
-    elif len == '%pk':  # private key message prefix
-        assert socket.recv(6).decode() == "003key"
-        return 1
-    elif len == 'bin':  # binary data message prefix (do not decode data)
-        len = socket.recv(3).decode()
-        return socket.recv(int(len))
-    elif len == 'end':  # client disconnect message prefix
-        return 0
-    len = int(len)
-    return socket.recv(len).decode()  # read the message
+    one client connection. The protocol version is picked from the first bytes (a hello for version 2 and up), then
+    bytes are fed to the version's decoder as they arrive and every complete message moves the connection along:
+    public key request, session key, nonce, name, then chat messages
+    """
+    def __init__(self, chat: ChatServer):
+        """
+        :param chat: the server the client joins
+        """
+        self.chat = chat
+        self.version = None
+        self.decoder = None
+        self.first = b""
+        self.transport = None
+        self.state = "new"
+        self.key = None
+        self.cipher = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        logging.info("new client added")
+
+    def data_received(self, data):
+        try:
+            if self.decoder is None:
+                accepted = accept_version(self.first + data)
+                if accepted is None:
+                    self.first += data
+                    return
+                self.version, answer, data = accepted
+                self.transport.write(answer)
+                self.decoder = get_decoder(self.version)
+                logging.debug("client speaks protocol version %d" % self.version)
+            for kind, payload in self.decoder.feed(data):
+                if self.transport.is_closing():
+                    break
+                logging.debug("new data received: %s" % str(payload))
+                self.handle(kind, payload)
+        # framing errors are ValueErrors too
+        except (ValueError, UnicodeDecodeError, ArithmeticError) as err:
+            logging.error("bad message from client, disconnecting: %s" % err)
+            self.transport.close()
+
+    def send(self, kind, payload=None):
+        """
+        send a message in the client's protocol version
+        :param kind: message kind, see framing.KINDS
+        :param payload: str for text messages, bytes for bin messages, None for the rest
+        """
+        self.transport.write(encode(kind, payload, self.version))
+
+    def handle(self, kind, payload):
+        """
+        act on a single message
+        :param kind: message kind, see framing.KINDS
+        :param payload: message payload
+        """
+        if kind == "end":
+            self.transport.close()
+        elif kind == "key" and self.state == "new":
+            logging.debug("unnamed client requested starting secure connection")
+            self.send("text", str(self.chat.private.e))
+            self.send("text", str(self.chat.private.n))
+            self.state = "session key"
+        elif self.state == "session key":
+            self.key = self.chat.private.decrypt(int(payload))
+            self.state = "nonce"
+        elif self.state == "nonce":
+            self.cipher = AesNew(int_to_bytes(self.key), payload)
+            self.state = "name"
+        elif self.state == "name":
+            self.state = "chat"
+            self.chat.join(self, self.cipher.decrypt(payload).decode())
+        elif self.state == "chat" and kind == "bin":
+            name = self.chat.clients[self]
+            msg = self.cipher.decrypt(payload).decode()
+            logging.debug("received message %s from client %s" % (msg, name))
+            self.chat.broadcast(name + ": " + msg)
+            logging.debug("sent message to all clients successfully")
+
+    def connection_lost(self, exc):
+        if exc is not None:
+            logging.error("connection with client aborted: %s" % exc)
+        self.chat.leave(self)
+
+# --------------------------- NETWORK FUNCS ---------------------------
 
 
 def int_to_bytes(num):
@@ -169,36 +199,17 @@ def int_to_bytes(num):
     return bytes(byte_list)
 
 
-def send_available(open_client_sockets):
-    """
-    function to check if all sockets are open to send a message to
-    :param open_client_sockets: a list of sockets to check
-    """
-    rlist, wlist, xlist = select.select(open_client_sockets,
-                                        open_client_sockets, open_client_sockets, 0.01)
-    for err in xlist:
-        open_client_sockets.remove(err)
-        err.close()
-    while len(wlist) != len(open_client_sockets):  # check if all sockets are available (wlist)
-        rlist, wlist, xlist = select.select(open_client_sockets,
-                                            open_client_sockets, open_client_sockets, 0.01)
-        for err in xlist:
-            open_client_sockets.remove(err)
-            err.close()
-
-
-def abort(sockets):
-    """
-    function to close all sockets
-    :param sockets: list of sockets to close
-    """
-    for i in sockets:
-        i.close()
-
-
 if __name__ == '__main__':
-    assert protocol_encode("nothing") == b"007nothing"
-    assert protocol_encode(b'test test', "bin") == b"bin009test test"
+    assert encode("text", "nothing", 1) == b"007nothing"
+    assert encode("bin", b'test test', 1) == b"bin009test test"
     assert int_to_bytes(123123123123) == b'\xb3\xc3\xb5\xaa\x1c'
+    parser = get_decoder(1)
+    assert parser.feed(b"%pk00") == []
+    assert parser.feed(b"3key007nothingbin003ab") == [("key", None), ("text", "nothing")]
+    assert parser.feed(b"cend000") == [("bin", b"abc"), ("end", None)]
+    parser = get_decoder(2)
+    frames = encode("key") + encode("bin", bytes(5000)) + encode("end")
+    assert parser.feed(frames[:7]) == [("key", None)]
+    assert parser.feed(frames[7:]) == [("bin", bytes(5000)), ("end", None)]
     logging.basicConfig(filename="server.log", level=logging.DEBUG)
     main()
@@ -0,0 +1,239 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: Cross-process entropy ring buffer in shared memory. One producer fills it with output of a Random object,
+and any number of consumer processes on the same host take bytes out of it without sockets or camera access of
+their own
+"""
+import argparse
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from chaotic_source import Random
+from conditioning import get_conditioner
+from frame_source import source_from_spec
+from locking import FileLock
+
+DEFAULT_NAME = "camerand_ring"
+RING_SIZE = 1 << 22
+CHUNK = 1 << 16
+# header: magic, capacity, write cursor, read cursor (the cursors count every byte ever written/read), producer status
+HEADER = 64
+MAGIC = 0x43414d52414e4432
+MAGIC_I, CAPACITY_I, WRITE_I, READ_I, STATUS_I = range(5)
+FIELDS = 5
+STATUS_RUNNING = 0
+STATUS_FAILED = 1
+STATUS_CLOSED = 2
+POLL = 0.001
+
+
+def lock_path(name):
+    """
+    :param name: shared memory name of the ring
+    :return: path of the ring's consumer lock file
+    """
+    return os.path.join(tempfile.gettempdir(), name + ".lock")
+
+
+class RingProducer:
+    """
+    fills the ring from a Random object in a background thread, waiting whenever the ring is full
+    """
+    def __init__(self, rand: Random, name=DEFAULT_NAME, size=RING_SIZE, chunk=CHUNK):
+        """
+        :param rand: the RNG object the ring is filled from
+        :param name: shared memory name consumers attach to
+        :param size: ring capacity in bytes
+        :param chunk: bytes requested from rand at a time
+        """
+        self.rand = rand
+        self.name = name
+        # readers take at most half the ring at a time, so a full ring always has enough for them
+        self.chunk = min(chunk, size // 2)
+        self.shm = shared_memory.SharedMemory(name, create=True, size=HEADER + size)
+        # the ring is removed explicitly in close(). Readers attach and detach from the resource tracker too, which
+        # is shared with forked readers, so it mustn't hold the ring while they are running
+        resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.header = np.ndarray(FIELDS, dtype=np.uint64, buffer=self.shm.buf)
+        self.data = np.ndarray(size, dtype=np.uint8, buffer=self.shm.buf, offset=HEADER)
+        self.header[:] = (MAGIC, size, 0, 0, STATUS_RUNNING)
+        self.stopped = threading.Event()
+        self.thread = None
+        self.error = None
+        logging.info("RingProducer: Created ring %s of %d bytes" % (name, size))
+
+    def _fill(self):
+        """
+        producer thread loop, a failure is recorded in the ring's header so consumers raise instead of waiting
+        """
+        capacity = len(self.data)
+        try:
+            while not self.stopped.is_set():
+                write = int(self.header[WRITE_I])
+                if capacity - (write - int(self.header[READ_I])) < self.chunk:
+                    time.sleep(POLL)
+                    continue
+                block = np.frombuffer(self.rand.get_random_bytes(self.chunk), dtype=np.uint8)
+                place = write % capacity
+                first = min(self.chunk, capacity - place)
+                self.data[place:place + first] = block[:first]
+                self.data[:self.chunk - first] = block[first:]
+                # the cursor is published only after the data is in place
+                self.header[WRITE_I] = write + self.chunk
+        except Exception as err:
+            logging.exception("RingProducer: Filling %s failed" % self.name)
+            self.error = "%s: %s" % (type(err).__name__, err)
+            self.header[STATUS_I] = STATUS_FAILED
+
+    def start(self):
+        """
+        start filling the ring in the background
+        """
+        self.thread = threading.Thread(target=self._fill, daemon=True)
+        self.thread.start()
+
+    def fill_level(self):
+        """
+        :return: number of unread bytes in the ring
+        """
+        return int(self.header[WRITE_I]) - int(self.header[READ_I])
+
+    def close(self):
+        """
+        stop filling and remove the ring, consumers still attached keep their mapping but get no more bytes
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.error is None:
+            self.header[STATUS_I] = STATUS_CLOSED
+        del self.header, self.data
+        self.shm.close()
+        resource_tracker.register(self.shm._name, "shared_memory")
+        self.shm.unlink()
+
+
+class RingRandom(Random):
+    """
+    a Random reading from a shared ring, with the same API as the camera one. Readers claim bytes by advancing the
+    shared read cursor under a file lock, so no byte is ever handed to two readers, and wipe them after copying
+    """
+    def __init__(self, name=DEFAULT_NAME, timeout=10.0):
+        """
+        :param name: shared memory name of the ring
+        :param timeout: seconds to wait for the producer before giving up on a request
+        """
+        self.name = name
+        self.timeout = timeout
+        self.shm = None
+        self.header = self.data = None
+        self.lock = FileLock(lock_path(name))
+        self.cont()
+
+    def __del__(self):
+        self.pause()
+
+    def pause(self):
+        """
+        detach from the ring
+        """
+        if self.shm is not None:
+            self.header = self.data = None
+            self.shm.close()
+            self.shm = None
+
+    def cont(self):
+        """
+        attach to the ring
+        """
+        if self.shm is None:
+            self.shm = shared_memory.SharedMemory(self.name)
+            # only the producer owns the ring, the resource tracker would otherwise remove it when this reader exits
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+            self.header = np.ndarray(FIELDS, dtype=np.uint64, buffer=self.shm.buf)
+            assert int(self.header[MAGIC_I]) == MAGIC, "%s is not an entropy ring" % self.name
+            self.data = np.ndarray(int(self.header[CAPACITY_I]), dtype=np.uint8, buffer=self.shm.buf, offset=HEADER)
+
+    def _claim(self, out: np.ndarray):
+        """
+        fill out with bytes from the ring, waiting for the producer if the ring runs dry
+        :param out: uint8 array to fill, at most the ring's capacity long
+        """
+        capacity = len(self.data)
+        n = len(out)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self.lock:
+                read = int(self.header[READ_I])
+                if int(self.header[WRITE_I]) - read >= n:
+                    place = read % capacity
+                    first = min(n, capacity - place)
+                    out[:first] = self.data[place:place + first]
+                    out[first:] = self.data[:n - first]
+                    self.data[place:place + first] = 0
+                    self.data[:n - first] = 0
+                    self.header[READ_I] = read + n
+                    return
+            status = int(self.header[STATUS_I])
+            if status == STATUS_FAILED:
+                raise RuntimeError("Entropy ring %s producer failed, see its log" % self.name)
+            if status == STATUS_CLOSED:
+                raise RuntimeError("Entropy ring %s was closed by its producer" % self.name)
+            if time.monotonic() > deadline:
+                raise RuntimeError("Entropy ring %s ran dry, is the producer running?" % self.name)
+            time.sleep(POLL)
+
+    def get_random_bytes(self, n: int, full_entropy=False):
+        """
+        Get n random bytes from the ring
+        :param n: number of bytes
+        :param full_entropy: ignored, the ring holds whatever the producer's Random gives
+        :return: bytes object of length n
+        """
+        out = np.empty(n, dtype=np.uint8)
+        step = len(self.data) // 2
+        for i in range(0, n, step):
+            self._claim(out[i:i + step])
+        return out.tobytes()
+
+    def _entropy_bytes(self, n: int):
+        return self.get_random_bytes(n)
+
+    def get_random_array(self, rang: int, full_entropy=False):
+        data = np.frombuffer(self.get_random_bytes(math.ceil(rang / 8)), dtype=np.uint8)
+        return np.unpackbits(data)[:rang]
+
+
+def main():
+    """
+    run a ring producer from the command line until interrupted
+    """
+    parser = argparse.ArgumentParser(description="CameRAND shared memory entropy ring producer")
+    parser.add_argument("--name", default=DEFAULT_NAME, help="shared memory name of the ring")
+    parser.add_argument("--size", type=int, default=RING_SIZE, help="ring capacity in bytes")
+    parser.add_argument("--source", default="camera", help="frame source spec, e.g. camera:0 or synthetic:1")
+    parser.add_argument("--mode", default="entropy", choices=("entropy", "drbg"))
+    parser.add_argument("--conditioner", default="none")
+    args = parser.parse_args()
+    rand = Random(source_from_spec(args.source), mode=args.mode, conditioner=get_conditioner(args.conditioner))
+    producer = RingProducer(rand, args.name, args.size)
+    producer.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        producer.close()
+        rand.pause()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename="shared_ring.log", level=logging.INFO)
+    main()
@@ -0,0 +1,78 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: Both framing versions round trip every message kind however the bytes are split, and oversized or
+malformed frames are rejected
+"""
+import pytest
+from framing import (HEADER, HELLO, KINDS, MAX_FRAME, V1_MAX, FrameDecoder, FrameError, V1Decoder, accept_version,
+                     encode, get_decoder)
+
+MESSAGES = [("text", "hello"), ("text", ""), ("bin", b"\x00\xff" * 10), ("key", None), ("text", "a" * V1_MAX),
+            ("name", None), ("bin", bytes(range(256))), ("end", None)]
+
+
+def stream(version):
+    return b"".join(encode(kind, payload, version) for kind, payload in MESSAGES)
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_round_trip(version):
+    assert get_decoder(version).feed(stream(version)) == MESSAGES
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_byte_at_a_time(version):
+    decoder = get_decoder(version)
+    messages = []
+    for i, byte in enumerate(stream(version)):
+        messages += decoder.feed(bytes([byte]))
+    assert messages == MESSAGES
+    assert not decoder.buffer
+
+
+def test_v1_wire_format():
+    assert encode("text", "hi", 1) == b"002hi"
+    assert encode("bin", b"\x01", 1) == b"bin001\x01"
+    assert encode("key", None, 1) == b"%pk003key"
+    assert encode("end", None, 1) == b"end000"
+    assert encode("name", None, 1) == b"%in"
+
+
+def test_v2_wire_format():
+    assert encode("text", "hi") == HEADER.pack(KINDS["text"], 2) + b"hi"
+    assert encode("end") == HEADER.pack(KINDS["end"], 0)
+
+
+def test_v1_rejects_long_messages():
+    with pytest.raises(FrameError):
+        encode("text", "a" * (V1_MAX + 1), 1)
+
+
+def test_v2_rejects_oversized_frames():
+    assert len(encode("bin", bytes(MAX_FRAME))) == HEADER.size + MAX_FRAME
+    with pytest.raises(FrameError):
+        encode("bin", bytes(MAX_FRAME + 1))
+    # the decoder refuses as soon as it sees the header, without buffering the payload
+    with pytest.raises(FrameError):
+        FrameDecoder().feed(HEADER.pack(KINDS["bin"], MAX_FRAME + 1))
+    with pytest.raises(FrameError):
+        FrameDecoder(max_frame=16).feed(encode("bin", bytes(17)))
+
+
+def test_malformed_frames():
+    with pytest.raises(FrameError):
+        FrameDecoder().feed(HEADER.pack(99, 0))
+    with pytest.raises(FrameError):
+        V1Decoder().feed(b"x12abc")
+    with pytest.raises(FrameError):
+        V1Decoder().feed(b"%pk004key")
+
+
+def test_accept_version():
+    assert accept_version(b"005hello") == (1, b"", b"005hello")
+    assert accept_version(HELLO[:2]) is None
+    assert accept_version(HELLO) is None
+    assert accept_version(HELLO + b"\x02rest") == (2, HELLO + b"\x02", b"rest")
+    # a newer client gets the highest version the server speaks
+    assert accept_version(HELLO + b"\x09")[0] == 2
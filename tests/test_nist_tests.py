@@ -0,0 +1,65 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: The battery against the worked examples of NIST SP 800-22 rev 1a, section 2 (the p-values printed there)
+"""
+import numpy as np
+import pytest
+from nist_tests import Battery
+
+# the 100 bit example sequence (the first bits of pi's binary expansion)
+PI_100 = "1100100100001111110110101010001000100001011010001100001000110100110001001100011001100010100010111000"
+# the 128 bit example of the longest run of ones test
+LONGEST_128 = ("11001100000101010110110001001100111000000000001001001101010100010001001111010110100000001101011111001100"
+               "111001101101100010110010")
+
+
+def results(bits, block_m=3, longest_m=8, apen_m=3, serial_m=3):
+    """
+    run the battery on a string of bits, fed as bits since the examples aren't whole bytes
+    :return: dict test name -> p-value
+    """
+    battery = Battery(block_m, longest_m, apen_m, serial_m)
+    battery._update_bits(np.array([int(bit) for bit in bits], dtype=np.uint8))
+    return battery.results()
+
+
+@pytest.mark.parametrize("bits, test, p_value", [
+    ("1011010101", "frequency", 0.527089),
+    ("0110011010", "block_frequency", 0.801252),
+    ("1001101011", "runs", 0.147232),
+    ("1011010111", "cusum_forward", 0.4116588),
+    ("0011011101", "serial_1", 0.808792),
+    ("0011011101", "serial_2", 0.670320),
+    ("0100110101", "approximate_entropy", 0.261961),
+])
+def test_short_examples(bits, test, p_value):
+    assert results(bits)[test] == pytest.approx(p_value, abs=1e-6)
+
+
+@pytest.mark.parametrize("test, p_value", [
+    ("frequency", 0.109599),
+    ("block_frequency", 0.706438),
+    ("runs", 0.500798),
+    ("cusum_forward", 0.219194),
+    ("cusum_backward", 0.114866),
+    ("approximate_entropy", 0.235301),
+])
+def test_pi_examples(test, p_value):
+    assert results(PI_100, block_m=10, apen_m=2)[test] == pytest.approx(p_value, abs=1e-6)
+
+
+def test_longest_run_example():
+    # the standard rounds its chi squared before the p-value, hence the looser tolerance
+    assert results(LONGEST_128, block_m=8, apen_m=2)["longest_run"] == pytest.approx(0.180609, abs=1e-4)
+
+
+def test_streaming_matches_one_chunk():
+    data = np.random.default_rng(1).integers(0, 256, 1 << 12, dtype=np.uint8).tobytes()
+    whole = Battery(longest_m=128, apen_m=4, serial_m=5)
+    whole.update(data)
+    chunked = Battery(longest_m=128, apen_m=4, serial_m=5)
+    for i in range(0, len(data), 100):
+        chunked.update(data[i:i + 100])
+    expected = whole.results()
+    assert chunked.results() == pytest.approx(expected)
@@ -0,0 +1,81 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: Prime store appends, takes, recovery from a torn append and migration of the old pickled prime list
+"""
+import os
+import pickle
+import pytest
+from prime_store import HEADER, PrimeStore
+from RSA import DEFAULT_KEY_SIZE, KEY_PROFILES, PUBLIC_EXPONENT
+
+BITS = KEY_PROFILES[DEFAULT_KEY_SIZE][0]
+# numbers of the store's size, the store doesn't test primality
+NUMS = [(3 << (BITS - 2)) + 2 * i + 1 for i in range(10)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PrimeStore(path=str(tmp_path / "primes.bin"))
+
+
+def test_empty(store):
+    assert store.available() == 0
+    assert store.take(5) == []
+
+
+def test_append_take(store):
+    store.append(NUMS[:4])
+    store.append(NUMS[4:])
+    assert store.available() == len(NUMS)
+    assert store.take(3) == NUMS[:3]
+    assert store.take(100) == NUMS[3:]
+    assert store.available() == 0
+    # taking everything starts the file over
+    assert os.path.getsize(store.path) == HEADER
+    store.append(NUMS[:2])
+    assert store.take(2) == NUMS[:2]
+
+
+def test_taken_primes_are_wiped(store):
+    store.append(NUMS)
+    store.take(4)
+    with open(store.path, "rb") as file:
+        data = file.read()
+    assert data[HEADER:HEADER + 4 * store.record] == bytes(4 * store.record)
+    assert store.available() == len(NUMS) - 4
+
+
+def test_shared_between_objects(store):
+    store.append(NUMS)
+    other = PrimeStore(path=store.path)
+    assert other.take(5) == NUMS[:5]
+    assert store.take(5) == NUMS[5:]
+
+
+def test_torn_append(store):
+    store.append(NUMS[:2])
+    with open(store.path, "ab") as file:
+        file.write(b"\x01\x02\x03")
+    store.append(NUMS[2:4])
+    assert (os.path.getsize(store.path) - HEADER) % store.record == 0
+    assert store.take(4) == NUMS[:4]
+
+
+def test_migrate(store):
+    bad_exponent = NUMS[0] - NUMS[0] % PUBLIC_EXPONENT + PUBLIC_EXPONENT + 1
+    short = 1 << (BITS - 1)
+    with open(store.path, "wb") as file:
+        pickle.dump([NUMS[0], bad_exponent, short, NUMS[1]], file)
+    assert store.take(10) == [NUMS[0], NUMS[1]]
+
+
+def test_refuses_other_files(store):
+    with open(store.path, "wb") as file:
+        file.write(b"not a prime store")
+    with pytest.raises(ValueError):
+        store.available()
+    with open(store.path, "wb") as file:
+        pickle.dump({"not": "a list"}, file)
+    with pytest.raises(ValueError):
+        store.available()
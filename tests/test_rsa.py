@@ -0,0 +1,67 @@
+"""
+Author: Eitan Unger
+Date: 18/10/26
+description: The prime search pieces against known primes, Carmichael numbers and pseudoprimes
+"""
+import math
+import numpy as np
+import pytest
+from RSA import SIEVE_PRIMES, baillie_psw, search_prime, sieve_window
+
+PRIMES = [5, 7, 97, 7919, 65537, 1000000007, 1000000000039, 2 ** 61 - 1, 2 ** 89 - 1, 2 ** 127 - 1,
+          2 ** 521 - 1, 2 ** 607 - 1]
+CARMICHAEL = [561, 1105, 1729, 2465, 2821, 6601, 8911, 10585, 15841, 29341, 41041, 62745, 63973, 75361, 101101,
+              126217, 172081, 188461, 252601, 278545, 294409, 314821, 334153, 340561, 399001, 410041, 449065,
+              488881, 512461, 9746347772161]
+# strong pseudoprimes to base 2 (pass the rabin-miller half of baillie-psw), and strong lucas pseudoprimes (pass the
+# other half)
+STRONG_PSEUDOPRIMES = [2047, 3277, 4033, 4681, 8321, 15841, 29341, 42799, 49141, 52633, 3215031751,
+                       3825123056546413051]
+LUCAS_PSEUDOPRIMES = [5459, 5777, 10877, 16109, 18971, 22499, 24569, 25199, 40309, 58519]
+
+
+@pytest.mark.parametrize("num", PRIMES)
+def test_baillie_psw_primes(num):
+    assert baillie_psw(num)
+
+
+@pytest.mark.parametrize("num", CARMICHAEL + STRONG_PSEUDOPRIMES + LUCAS_PSEUDOPRIMES)
+def test_baillie_psw_composites(num):
+    assert not baillie_psw(num)
+
+
+def test_baillie_psw_small_odd_numbers():
+    for num in range(5, 20000, 2):
+        if math.isqrt(num) ** 2 == num:
+            # strong lucas needs a non-square, search_prime never gets that far with one
+            continue
+        assert baillie_psw(num) == all(num % d for d in range(3, math.isqrt(num) + 1, 2)), num
+
+
+@pytest.mark.parametrize("base", [10 ** 12 + 1, 2 ** 61 - 1001, 3 * 2 ** 40 + 1])
+def test_sieve_window_marks_exactly_the_multiples(base):
+    size = 4096
+    residues = np.array([base % p for p in SIEVE_PRIMES.tolist()], dtype=np.int64)
+    composite = sieve_window(residues, size)
+    primes = SIEVE_PRIMES.astype(np.int64)
+    expected = [bool(np.any((base + 2 * i) % primes == 0)) for i in range(size)]
+    assert composite.tolist() == expected
+
+
+def test_sieve_window_keeps_known_primes():
+    base = 10 ** 12 + 1
+    residues = np.array([base % p for p in SIEVE_PRIMES.tolist()], dtype=np.int64)
+    composite = sieve_window(residues, 64)
+    # 10^12 + 39 is the first prime after 10^12
+    assert not composite[19]
+    assert all(composite[i] or not baillie_psw(base + 2 * i) for i in range(19))
+
+
+def test_search_prime_finds_the_next_prime():
+    assert search_prime(10 ** 12 + 1) == 10 ** 12 + 39
+
+
+def test_search_prime_skips_primes_one_mod_the_exponent():
+    # 65538310741 = 65537 * 1000020 + 1 is prime, but p - 1 shares a factor with the public exponent
+    assert baillie_psw(65538310741)
+    assert search_prime(65538310741) == 65538310759